@@ -1,10 +1,21 @@
+import copy
+import os
 import time
 import json
+import uuid
 import statistics
+import numpy as np
 import pandas as pd
+import Dataset_cache
+import Measurement
+import Parallel_ingest
+import Query_cache
 from clickhouse_driver import Client
 from os import getenv
 from dotenv import load_dotenv, find_dotenv
+from Measurement import measure_execution_time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from csv import DictReader
 
 
@@ -14,6 +25,8 @@ host = getenv("HOST")
 port = getenv("PORT")
 user = getenv("USER")
 database = getenv("DATABASE")
+# Читать рецепты из колоночного кэша Arrow вместо повторного разбора CSV
+use_dataset_cache = getenv("USE_DATASET_CACHE", "1") == "1"
 
 results = {
     "insert": {
@@ -49,8 +62,135 @@ results = {
 # Создаем клиент для подключения к ClickHouse
 client = Client(host=host, port=port, user=user, database=database)
 print(f"Connecting to ClickHouse at {host}:{port} with user {user}")
-
-csv_file_path = 'dataset/full_dataset.csv'
+# Кэш результатов выборок; инвалидируется на всех путях записи в recipes
+query_cache = Query_cache.create('clickhouse')
+
+# Можно указать синтетический набор из Dataset_generator.py: CSV или готовый кэш .arrow
+# (файл .arrow всегда читается через Dataset_cache, параллельный разбор CSV для него пропускается)
+csv_file_path = getenv("CLICKHOUSE_DATASET_PATH", 'dataset/full_dataset.csv')
+
+# Конфигурации движка вставки: колоночная или строчная передача (при желании через numpy),
+# размер блока, сжатие на стороне клиента и число параллельных соединений
+insert_configurations = [
+    {"name": "rows", "columnar": False, "use_numpy": False,
+     "insert_block_size": 1048576, "compression": False, "workers": 1},
+    {"name": "columnar", "columnar": True, "use_numpy": False,
+     "insert_block_size": 1048576, "compression": False, "workers": 1},
+    {"name": "columnar_block_100k", "columnar": True, "use_numpy": False,
+     "insert_block_size": 100000, "compression": False, "workers": 1},
+    {"name": "columnar_numpy", "columnar": True, "use_numpy": True,
+     "insert_block_size": 1048576, "compression": False, "workers": 1},
+    {"name": "columnar_lz4", "columnar": True, "use_numpy": False,
+     "insert_block_size": 1048576, "compression": "lz4", "workers": 1},
+    {"name": "columnar_zstd", "columnar": True, "use_numpy": False,
+     "insert_block_size": 1048576, "compression": "zstd", "workers": 1},
+    {"name": "columnar_lz4_parallel_4", "columnar": True, "use_numpy": False,
+     "insert_block_size": 1048576, "compression": "lz4", "workers": 4},
+]
+# Количество процессов для конвейерного разбора CSV при вставке
+ingest_worker_counts = sorted({1, os.cpu_count() or 1})
+# Варианты схемы таблицы recipes:
+# base - только ORDER BY title,
+# skip_indexes - индексы пропуска данных ngrambf_v1/tokenbf_v1 по title и bloom_filter по NER,
+# ner_view - те же индексы и материализованное представление с готовыми частотами NER,
+# zstd_codecs - base со сжатием ZSTD(3) строковых столбцов вместо LZ4 по умолчанию (для сравнения объема)
+schema_variants = getenv("CLICKHOUSE_SCHEMA_VARIANTS", "base,skip_indexes,ner_view").split(',')
+schema_variant = 'base'
+schema_skip_indexes = """,
+        INDEX title_ngram title TYPE ngrambf_v1(3, 512, 3, 0) GRANULARITY 1,
+        INDEX title_tokens title TYPE tokenbf_v1(512, 3, 0) GRANULARITY 1,
+        INDEX ner_bloom NER TYPE bloom_filter(0.01) GRANULARITY 1"""
+schema_zstd_codec = ' CODEC(ZSTD(3))'
+# Мутации ALTER ... UPDATE/DELETE асинхронны: async - замеряется только отправка,
+# sync - ожидание через mutations_sync, poll - опрос system.mutations до завершения
+mutation_wait_mode = getenv("CLICKHOUSE_MUTATION_WAIT", "sync")
+# Запросы операций; их же использует генератор нагрузки
+select_most_common_ner_query = """
+    SELECT
+        arrayJoin(NER) AS k,
+        count() AS c
+    FROM recipes
+    GROUP BY k
+    ORDER BY c DESC
+    LIMIT 50
+    """
+select_most_common_ner_view_query = """
+    SELECT k, sum(c) AS c
+    FROM recipes_ner_counts
+    GROUP BY k
+    ORDER BY c DESC
+    LIMIT 50
+    """
+select_chicken_parmesan_query = """
+    SELECT
+        arrayJoin(directions)
+    FROM recipes
+    WHERE title = 'Baked Chicken Parmesan';
+    """
+delete_mutation_query = "ALTER TABLE recipes DELETE WHERE match(title, 'pie')"
+update_mutation_query = """
+    ALTER TABLE recipes
+    UPDATE NER = arrayMap(x -> replaceAll(x, 'water', 'TEST'), NER)
+    WHERE has(NER, 'water')
+    """
+# Шардированный режим: узлы host:port (нативный протокол) через запятую, например несколько локальных серверов.
+# Запросы идут через remote() к первым 1..N узлам; если в remote_servers описан кластер CLICKHOUSE_CLUSTER
+# из этих узлов, вместо remote() ко всем N узлам используется таблица Distributed
+shard_endpoints = [endpoint for endpoint in getenv("CLICKHOUSE_SHARDS", "").split(',') if endpoint]
+shard_cluster = getenv("CLICKHOUSE_CLUSTER", "")
+shard_key = 'cityHash64(title)'
+# Стратегии записи для сравнения: таблица, запросы удаления/обновления, настройки и ожидание мутаций
+write_strategies = {
+    "mutation_async": {"table": "recipes", "delete": delete_mutation_query, "update": update_mutation_query,
+                       "settings": None, "poll": False},
+    "mutation_sync": {"table": "recipes", "delete": delete_mutation_query, "update": update_mutation_query,
+                      "settings": {"mutations_sync": 2}, "poll": False},
+    "mutation_poll": {"table": "recipes", "delete": delete_mutation_query, "update": update_mutation_query,
+                      "settings": None, "poll": True},
+    # Легковесное удаление помечает строки маской, легковесного обновления для этой операции нет
+    "lightweight": {"table": "recipes", "delete": "DELETE FROM recipes WHERE match(title, 'pie')", "update": None,
+                    "settings": None, "poll": False},
+    # ReplacingMergeTree(version, is_deleted): изменения записываются новыми версиями строк
+    "replacing": {"table": "recipes_replacing",
+                  "delete": """
+    INSERT INTO recipes_replacing
+    SELECT title, ingredients, directions, link, source, NER, version + 1, 1
+    FROM recipes_replacing FINAL
+    WHERE match(title, 'pie')
+    """,
+                  "update": """
+    INSERT INTO recipes_replacing
+    SELECT title, ingredients, directions, link, source,
+           arrayMap(x -> replaceAll(x, 'water', 'TEST'), NER), version + 1, 0
+    FROM recipes_replacing FINAL
+    WHERE has(NER, 'water')
+    """,
+                  "settings": None, "poll": False},
+    # CollapsingMergeTree(sign): удаление - строка с sign = -1, обновление - пара строк -1/+1
+    "collapsing": {"table": "recipes_collapsing",
+                   "delete": """
+    INSERT INTO recipes_collapsing
+    SELECT title, ingredients, directions, link, source, NER, -1
+    FROM recipes_collapsing FINAL
+    WHERE match(title, 'pie')
+    """,
+                   "update": """
+    INSERT INTO recipes_collapsing
+    SELECT title, ingredients, directions, link, source,
+           if(new_sign = 1, arrayMap(x -> replaceAll(x, 'water', 'TEST'), NER), NER), new_sign
+    FROM (
+        SELECT title, ingredients, directions, link, source, NER, arrayJoin([-1, 1]) AS new_sign
+        FROM recipes_collapsing FINAL
+        WHERE has(NER, 'water')
+    )
+    """,
+                   "settings": None, "poll": False},
+}
+# Сколько строк и байт прочитал сервер для каждой операции (по client.last_query.progress)
+read_progress = {}
+# query_id запросов бенчмарка по операциям: по ним находятся строки в system.query_log
+benchmark_query_ids = {}
+recipe_insert_query = 'INSERT INTO recipes (title, ingredients, directions, link, source, NER) VALUES'
 
 
 def write_results_to_excel(results, filename='results.xlsx'):
@@ -65,54 +205,113 @@ def write_results_to_excel(results, filename='results.xlsx'):
         print(f"Error saving results to Excel: {e}")
 
 
-def measure_execution_time(func):
-    def wrapper(*args, **kwargs):
-        start_time = time.monotonic()
-        result = None
-        try:
-            result = func(*args, **kwargs)
-        except Exception as e:
-            print(f"Error executing {func.__name__}: {e}")
-        end_time = time.monotonic()
-        execution_time = end_time - start_time
-        return result, execution_time
-    return wrapper
-
-
 @measure_execution_time
 def drop_table_if_exists():
     drop_table_query = "DROP TABLE IF EXISTS recipes"
     try:
+        client.execute("DROP TABLE IF EXISTS recipes_ner_counts_mv")
+        client.execute("DROP TABLE IF EXISTS recipes_ner_counts")
+        for table_name in ('recipes_template', 'recipes_replacing', 'recipes_replacing_template',
+                           'recipes_collapsing', 'recipes_collapsing_template'):
+            client.execute(f"DROP TABLE IF EXISTS {table_name}")
         client.execute(drop_table_query)
         print("Table 'recipes' dropped if it existed.")
     except Exception as e:
         print(f"Error dropping table: {e}")
 
 
-def create_table():
-    create_table_query = """
-    CREATE TABLE IF NOT EXISTS recipes
+def recipes_table_query(variant='base', table_name='recipes'):
+    indexes = schema_skip_indexes if variant in ('skip_indexes', 'ner_view') else ''
+    codec = schema_zstd_codec if variant == 'zstd_codecs' else ''
+    return f"""
+    CREATE TABLE IF NOT EXISTS {table_name}
     (
-        title String,
-        ingredients Array(String),
-        directions Array(String),
-        link String,
+        title String{codec},
+        ingredients Array(String){codec},
+        directions Array(String){codec},
+        link String{codec},
         source LowCardinality(String),
-        NER Array(String)
+        NER Array(String){codec}{indexes}
     ) ENGINE = MergeTree ORDER BY title;
     """
+
+
+def create_table(variant='base'):
+    global schema_variant
+    schema_variant = variant
     try:
-        client.execute(create_table_query)
-        print("Table 'recipes' created or already exists.")
+        client.execute(recipes_table_query(variant))
+        print(f"Table 'recipes' ({variant}) created or already exists.")
+        if variant == 'ner_view':
+            # Представление учитывает только вставки, мутации UPDATE/DELETE в нем не отражаются
+            client.execute("""
+            CREATE TABLE IF NOT EXISTS recipes_ner_counts (k String, c UInt64)
+            ENGINE = SummingMergeTree ORDER BY k
+            """)
+            client.execute("""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS recipes_ner_counts_mv TO recipes_ner_counts AS
+            SELECT arrayJoin(NER) AS k, count() AS c FROM recipes GROUP BY k
+            """)
+            print("Materialized view 'recipes_ner_counts_mv' created or already exists.")
     except Exception as e:
         print(f"Error creating table: {e}")
 
 
+def track_read_progress(operation):
+    progress = client.last_query.progress
+    read_progress.setdefault(operation, []).append((progress.rows, progress.bytes))
+
+
+def new_query_id(operation):
+    query_id = f"{operation}-{uuid.uuid4()}"
+    benchmark_query_ids.setdefault(operation, []).append(query_id)
+    return query_id
+
+
+def server_metrics_summary(operation, execution_times):
+    # Серверная сторона замеренных итераций (итерации прогрева отбрасываются) из system.query_log.
+    # Для мутаций в режиме poll учитывается только сам запрос ALTER, без опроса system.mutations
+    query_ids = benchmark_query_ids.pop(operation, [])[-len(execution_times):]
+    if not query_ids:
+        return {}
+    query_log_query = """
+    SELECT
+        toUnixTimestamp64Micro(event_time_microseconds) - toUnixTimestamp64Micro(query_start_time_microseconds),
+        read_rows, read_bytes, memory_usage
+    FROM system.query_log
+    WHERE type = 'QueryFinish' AND query_id IN %(query_ids)s
+    """
+    try:
+        client.execute("SYSTEM FLUSH LOGS")
+        rows = client.execute(query_log_query, {'query_ids': tuple(query_ids)})
+    except Exception as e:
+        print(f"Error reading query_log: {e}")
+        return {}
+    if not rows:
+        return {}
+    summary = Measurement.server_breakdown(execution_times[-len(rows):], sum(row[0] for row in rows) / 1e6)
+    summary["server_read_rows"] = round(statistics.mean(row[1] for row in rows))
+    summary["server_read_bytes"] = round(statistics.mean(row[2] for row in rows))
+    summary["server_memory_usage"] = round(statistics.mean(row[3] for row in rows))
+    summary["server_peak_memory_usage"] = max(row[3] for row in rows)
+    return summary
+
+
+def read_progress_summary(operation):
+    samples = read_progress.pop(operation, [])
+    if not samples:
+        return {"rows_read": 0, "bytes_read": 0}
+    return {
+        "rows_read": round(statistics.mean(rows for rows, _ in samples)),
+        "bytes_read": round(statistics.mean(read_bytes for _, read_bytes in samples)),
+    }
+
+
 def parse_array_string(value):
     if value.strip() == '':
         return []
     else:
-        return value.strip()[1:-1].split(',')
+        return json.loads(value)
 
 
 def iter_csv(csv_file, limit=None):
@@ -138,17 +337,29 @@ def truncate_table(table_name):
     truncate_query = f'TRUNCATE table {table_name}'
     try:
         client.execute(truncate_query)
+        if schema_variant == 'ner_view' and table_name == 'recipes':
+            client.execute('TRUNCATE table recipes_ner_counts')
+        Query_cache.invalidate(query_cache, table_name)
         print(f'All records DELETED from {table_name}.')
     except Exception as e:
         print(f"Error deleting records: {e}")
 
 
+def load_rows(limit=None):
+    # Строки из кэша готовятся один раз до замеров, чтобы время вставки не включало разбор CSV
+    if use_dataset_cache or Dataset_cache.is_arrow(csv_file_path):
+        return list(Dataset_cache.iter_recipes(csv_file_path, limit))
+    return None
+
+
 @measure_execution_time
-def insert_values(limit=None):
+def insert_values(limit=None, rows=None):
     insert_query = 'INSERT INTO recipes VALUES'
     try:
-        client.execute(insert_query, iter_csv(csv_file_path, limit))
-        print("Values inserted successfully")
+        client.execute(insert_query, rows if rows is not None else iter_csv(csv_file_path, limit),
+                       query_id=new_query_id('insert_values'))
+        Query_cache.invalidate(query_cache, 'recipes')
+        Measurement.log("Values inserted successfully")
     except Exception as e:
         print(f"Error inserting values: {e}")
         return
@@ -156,38 +367,170 @@ def insert_values(limit=None):
 
 def perform_insert_table_operations(iterations: int, table_name: str, limit: int) -> list[float]:
     execution_times = []
-    for _ in range(iterations):
+    rows = load_rows(limit)
+    for iteration in range(Measurement.warmup_iterations + iterations):
         truncate_table(table_name)
-        _, exec_time = insert_values(limit)
-        execution_times.append(exec_time)
-
-    mean_insert_time = round(statistics.mean(execution_times), 5)
-    variance_insert_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
+        _, exec_time = insert_values(limit, rows)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
 
-    results["insert"]["iterations"] = iterations
-    results["insert"]["mean_time"] = mean_insert_time
-    results["insert"]["variance_time"] = variance_insert_time
-    results["insert"]["total_execution_time"] = total_execution_time
+    Measurement.store_results(results["insert"], execution_times, sample_name="insert")
+    results["insert"].update(server_metrics_summary('insert_values', execution_times))
 
     return execution_times
 
 
+def load_columns(limit=None):
+    if use_dataset_cache or Dataset_cache.is_arrow(csv_file_path):
+        return Dataset_cache.load_columns(csv_file_path, limit)
+    rows = list(iter_csv(csv_file_path, limit))
+    return [[row[column] for row in rows] for column in Dataset_cache.RECIPE_COLUMNS]
+
+
+def estimate_payload_bytes(columns):
+    # Объем несжатых строковых данных, по нему считается пропускная способность в MB/s
+    total = 0
+    for column in columns:
+        for value in column:
+            if isinstance(value, list):
+                total += sum(len(item.encode('utf-8')) for item in value)
+            else:
+                total += len(value.encode('utf-8'))
+    return total
+
+
+def create_insert_clients(configuration):
+    insert_clients = [
+        Client(host=host, port=port, user=user, database=database,
+               compression=configuration["compression"],
+               settings={"insert_block_size": configuration["insert_block_size"],
+                         "use_numpy": configuration["use_numpy"]})
+        for _ in range(configuration["workers"])
+    ]
+    # Устанавливаем соединения заранее, чтобы не включать их в замер
+    for insert_client in insert_clients:
+        insert_client.execute('SELECT 1')
+    return insert_clients
+
+
+def prepare_insert_chunks(columns, configuration):
+    # Делим данные на независимые части по числу соединений и приводим к нужному виду до замера
+    total_rows = len(columns[0])
+    step = max(1, -(-total_rows // configuration["workers"]))
+    chunks = []
+    for start in range(0, total_rows, step):
+        chunk = [column[start:start + step] for column in columns]
+        if not configuration["columnar"]:
+            chunk = list(zip(*chunk))
+        elif configuration["use_numpy"]:
+            chunk = [np.array(column, dtype=object) if isinstance(column[0], str) else column
+                     for column in chunk]
+        chunks.append(chunk)
+    return chunks
+
+
+@measure_execution_time
+def insert_chunks(insert_clients, chunks, columnar):
+    Query_cache.invalidate(query_cache, 'recipes')
+    if len(insert_clients) == 1:
+        for chunk in chunks:
+            insert_clients[0].execute(recipe_insert_query, chunk, columnar=columnar)
+        return
+    with ThreadPoolExecutor(max_workers=len(insert_clients)) as executor:
+        futures = [executor.submit(insert_client.execute, recipe_insert_query, chunk, columnar=columnar)
+                   for insert_client, chunk in zip(insert_clients, chunks)]
+        for future in futures:
+            future.result()
+
+
+@measure_execution_time
+def insert_values_parallel_ingest(limit=None, workers=None):
+    # Драйвер забирает строки из генератора блоками, пока пул процессов разбирает следующие диапазоны
+    batches = Parallel_ingest.iter_decoded_batches(csv_file_path, limit, workers)
+    # Для INSERT с данными execute возвращает число вставленных строк
+    inserted = client.execute(recipe_insert_query, chain.from_iterable(batches))
+    Query_cache.invalidate(query_cache, 'recipes')
+    return inserted
+
+
+def perform_insert_parallel_ingest_operations(iterations: int, table_name: str, limit: int) -> dict:
+    ingest_execution_times = {}
+    if Dataset_cache.is_arrow(csv_file_path):
+        print(f"Skipping parallel ingest: {csv_file_path} is not a CSV file")
+        return ingest_execution_times
+    for workers in ingest_worker_counts:
+        execution_times = []
+        for _ in range(iterations):
+            truncate_table(table_name)
+            inserted, exec_time = insert_values_parallel_ingest(limit, workers)
+            execution_times.append(exec_time)
+
+        section = Measurement.summarize(execution_times)
+        # Делим на фактически вставленные строки: limit может быть не задан или больше файла;
+        # если вставка завершилась ошибкой, inserted равен None
+        section["rows_per_second"] = round(inserted / section["mean_time"], 2) \
+            if inserted and section["mean_time"] else 0
+        results[f"ingest_workers_{workers}"] = section
+        Measurement.export_samples(f"ingest_workers_{workers}", execution_times)
+        ingest_execution_times[workers] = execution_times
+
+    return ingest_execution_times
+
+
+def perform_insert_engine_operations(iterations: int, table_name: str, limit: int) -> dict:
+    columns = load_columns(limit)
+    rows_count = len(columns[0])
+    payload_megabytes = estimate_payload_bytes(columns) / 1024 ** 2
+    engine_execution_times = {}
+    for configuration in insert_configurations:
+        insert_clients = create_insert_clients(configuration)
+        chunks = prepare_insert_chunks(columns, configuration)
+        execution_times = []
+        for _ in range(iterations):
+            truncate_table(table_name)
+            _, exec_time = insert_chunks(insert_clients, chunks, configuration["columnar"])
+            execution_times.append(exec_time)
+        for insert_client in insert_clients:
+            insert_client.disconnect()
+
+        section = Measurement.summarize(execution_times)
+        section.update({
+            "rows_per_second": round(rows_count / section["mean_time"], 2),
+            "mb_per_second": round(payload_megabytes / section["mean_time"], 2),
+            "columnar": configuration["columnar"],
+            "use_numpy": configuration["use_numpy"],
+            "insert_block_size": configuration["insert_block_size"],
+            "compression": configuration["compression"] or "none",
+            "workers": configuration["workers"],
+        })
+        results[f"insert_{configuration['name']}"] = section
+        Measurement.export_samples(f"insert_{configuration['name']}", execution_times)
+        engine_execution_times[configuration["name"]] = execution_times
+
+    return engine_execution_times
+
+
+def most_common_ner_query():
+    if schema_variant == 'ner_view':
+        return select_most_common_ner_view_query
+    return select_most_common_ner_query
+
+
+def execute_tracked(query, operation):
+    # Запрос с query_id для system.query_log и учетом прочитанных строк; при попадании в кэш не выполняется
+    rows = client.execute(query, query_id=new_query_id(operation))
+    track_read_progress(operation)
+    return rows
+
+
 @measure_execution_time
 def select_most_common_ner():
-    fetch_query = f"""
-    SELECT
-        arrayJoin(NER) AS k,
-        count() AS c
-    FROM recipes
-    GROUP BY k
-    ORDER BY c DESC
-    LIMIT 50
-    """
+    fetch_query = most_common_ner_query()
     try:
-        client.execute(fetch_query)
-        print("Query executed successfully.")
-        # print(client.execute(fetch_query))
+        rows = Query_cache.cached(query_cache, 'recipes', fetch_query, lambda: execute_tracked(
+            fetch_query, 'select_most_common_ner'))
+        Measurement.log("Query executed successfully.")
+        return rows
     except Exception as e:
         print(f"Error executing query: {e}")
         return
@@ -195,34 +538,27 @@ def select_most_common_ner():
 
 def perform_select_table_operations_most_common(iterations: int):
     execution_times = []
-    for _ in range(iterations):
+    for iteration in range(Measurement.warmup_iterations + iterations):
         _, exec_time = select_most_common_ner()
-        execution_times.append(exec_time)
-
-    mean_select_time = round(statistics.mean(execution_times), 5)
-    variance_select_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
 
-    results["select"]["iterations"] = iterations
-    results["select"]["mean_time"] = mean_select_time
-    results["select"]["variance_time"] = variance_select_time
-    results["select"]["total_execution_time"] = total_execution_time
+    Measurement.store_results(results["select"], execution_times, sample_name="select")
+    for name, value in read_progress_summary('select_most_common_ner').items():
+        results["select"][name] = value
+    results["select"].update(server_metrics_summary('select_most_common_ner', execution_times))
 
     return execution_times
 
 
 @measure_execution_time
 def select_recipes_chicken_parmesan():
-    select_query = f"""
-    SELECT
-        arrayJoin(directions)
-    FROM recipes
-    WHERE title = 'Baked Chicken Parmesan';
-    """
+    select_query = select_chicken_parmesan_query
     try:
-        client.execute(select_query)
-        print('Query executed successfully.')
-        # print(client.execute(select_query))
+        rows = Query_cache.cached(query_cache, 'recipes', select_query, lambda: execute_tracked(
+            select_query, 'select_recipes_chicken_parmesan'))
+        Measurement.log('Query executed successfully.')
+        return rows
     except Exception as e:
         print(f'Error executing query: {e}')
         return
@@ -230,114 +566,415 @@ def select_recipes_chicken_parmesan():
 
 def perform_select_table_operations_chicken(iterations: int):
     execution_times = []
-    for _ in range(iterations):
+    for iteration in range(Measurement.warmup_iterations + iterations):
         _, exec_time = select_recipes_chicken_parmesan()
-        execution_times.append(exec_time)
-
-    mean_select_time = round(statistics.mean(execution_times), 5)
-    variance_select_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
 
-    results["select"]["iterations_2"] = iterations
-    results["select"]["mean_time_2"] = mean_select_time
-    results["select"]["variance_time_2"] = variance_select_time
-    results["select"]["total_execution_time_2"] = total_execution_time
+    Measurement.store_results(results["select"], execution_times, '_2', sample_name="select_2")
+    for name, value in read_progress_summary('select_recipes_chicken_parmesan').items():
+        results["select"][f"{name}_2"] = value
+    for name, value in server_metrics_summary('select_recipes_chicken_parmesan', execution_times).items():
+        results["select"][f"{name}_2"] = value
 
     return execution_times
 
 
+def wait_for_mutations(table_name, timeout=600, interval=0.01):
+    wait_query = """
+    SELECT count()
+    FROM system.mutations
+    WHERE database = currentDatabase() AND table = %(table)s AND NOT is_done
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not client.execute(wait_query, {'table': table_name})[0][0]:
+            return
+        time.sleep(interval)
+    raise TimeoutError(f"Mutations on {table_name} did not finish in {timeout} s")
+
+
+def execute_mutation(query, table_name='recipes', wait_mode=None, query_id=None):
+    wait_mode = wait_mode or mutation_wait_mode
+    settings = {"mutations_sync": 2} if wait_mode == 'sync' else None
+    client.execute(query, settings=settings, query_id=query_id)
+    if wait_mode == 'poll':
+        wait_for_mutations(table_name)
+
+
 @measure_execution_time
 def delete_records_with_pie():
-    delete_query = """
-    ALTER TABLE recipes DELETE WHERE match(title, 'pie')
-    """
     try:
-        client.execute(delete_query)
-        print("Records containing 'pie' in title deleted successfully.")
+        execute_mutation(delete_mutation_query, query_id=new_query_id('delete_records_with_pie'))
+        Query_cache.invalidate(query_cache, 'recipes')
+        track_read_progress('delete_records_with_pie')
+        Measurement.log("Records containing 'pie' in title deleted successfully.")
     except Exception as e:
         print(f'Error executing query: {e}')
         return
 
 
-def create_backup_table():
+def create_template_table(table_name='recipes'):
+    # Нетронутая копия таблицы: ATTACH PARTITION ... FROM создает жесткие ссылки на куски,
+    # поэтому данные не копируются ни при создании шаблона, ни при восстановлении
     try:
-        client.execute("DROP TABLE IF EXISTS recipes_backup")
-        client.execute("CREATE TABLE recipes_backup AS recipes")
-        client.execute("INSERT INTO recipes_backup SELECT * FROM recipes")
-        print("Backup table created.")
+        client.execute(f"DROP TABLE IF EXISTS {table_name}_template")
+        client.execute(f"CREATE TABLE {table_name}_template AS {table_name}")
+        client.execute(f"ALTER TABLE {table_name}_template ATTACH PARTITION tuple() FROM {table_name}")
+        print(f"Template table for '{table_name}' created.")
     except Exception as e:
-        print(f"Error creating backup table: {e}")
+        print(f"Error creating template table: {e}")
 
 
-def restore_from_backup():
+@measure_execution_time
+def reset_from_template(table_name='recipes'):
+    # Таблица не пересоздается, поэтому индексы и материализованное представление
+    # остаются привязанными к ней; ATTACH PARTITION не вызывает представление повторно
     try:
-        client.execute("DROP TABLE IF EXISTS recipes")
-        client.execute("CREATE TABLE recipes AS recipes_backup")
-        client.execute("INSERT INTO recipes SELECT * FROM recipes_backup")
-        print("Table restored from backup.")
+        client.execute(f"TRUNCATE table {table_name}")
+        client.execute(f"ALTER TABLE {table_name} ATTACH PARTITION tuple() FROM {table_name}_template")
+        Query_cache.invalidate(query_cache, table_name)
+        Measurement.log(f"Table '{table_name}' reset from template.")
     except Exception as e:
-        print(f"Error creating backup table from backup: {e}")
+        print(f"Error resetting table from template: {e}")
 
 
 def perform_delete_table_operations_pie(iterations: int):
     execution_times = []
-    create_backup_table()
-    for _ in range(iterations):
+    reset_times = []
+    create_template_table()
+    for iteration in range(Measurement.warmup_iterations + iterations):
         _, exec_time = delete_records_with_pie()
-        restore_from_backup()
-        execution_times.append(exec_time)
-    mean_select_time = round(statistics.mean(execution_times), 5)
-    variance_select_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
-
-    results["delete"]["iterations"] = iterations
-    results["delete"]["mean_time"] = mean_select_time
-    results["delete"]["variance_time"] = variance_select_time
-    results["delete"]["total_execution_time"] = total_execution_time
+        _, reset_time = reset_from_template()
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+        reset_times.append(reset_time)
+    Measurement.store_results(results["delete"], execution_times, sample_name="delete")
+    results["delete"]["reset_mean_time"] = round(statistics.mean(reset_times), 5)
+    results["delete"]["reset_total_time"] = round(sum(reset_times), 5)
+    results["delete"]["mutation_wait"] = mutation_wait_mode
+    results["delete"].update(read_progress_summary('delete_records_with_pie'))
+    results["delete"].update(server_metrics_summary('delete_records_with_pie', execution_times))
 
     return execution_times
 
 
 @measure_execution_time
 def update_ingredients_water_to_test():
-    update_query = """
-    ALTER TABLE recipes 
-    UPDATE NER = arrayMap(x -> replaceAll(x, ' "water"', ' "TEST"'), NER) 
-    WHERE arrayExists(x -> x = ' "water"', NER);
-    """
     try:
-        client.execute(update_query)
-        print('Ingredients updated successfully.')
+        execute_mutation(update_mutation_query, query_id=new_query_id('update_ingredients_water_to_test'))
+        Query_cache.invalidate(query_cache, 'recipes')
+        track_read_progress('update_ingredients_water_to_test')
+        Measurement.log('Ingredients updated successfully.')
     except Exception as e:
         print(f"Error updating ingredients: {e}")
 
 
 def perform_update_table_operations(iterations: int):
     execution_times = []
-    create_backup_table()
-    for _ in range(iterations):
+    reset_times = []
+    create_template_table()
+    for iteration in range(Measurement.warmup_iterations + iterations):
         _, exec_time = update_ingredients_water_to_test()
-        restore_from_backup()
-        execution_times.append(exec_time)
-    mean_select_time = round(statistics.mean(execution_times), 5)
-    variance_select_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
-
-    results["update"]["iterations"] = iterations
-    results["update"]["mean_time"] = mean_select_time
-    results["update"]["variance_time"] = variance_select_time
-    results["update"]["total_execution_time"] = total_execution_time
+        _, reset_time = reset_from_template()
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+        reset_times.append(reset_time)
+    Measurement.store_results(results["update"], execution_times, sample_name="update")
+    results["update"]["reset_mean_time"] = round(statistics.mean(reset_times), 5)
+    results["update"]["reset_total_time"] = round(sum(reset_times), 5)
+    results["update"]["mutation_wait"] = mutation_wait_mode
+    results["update"].update(read_progress_summary('update_ingredients_water_to_test'))
+    results["update"].update(server_metrics_summary('update_ingredients_water_to_test', execution_times))
 
     return execution_times
 
 
-create_table()
-perform_insert_table_operations(10, 'recipes', 10000)
-perform_select_table_operations_most_common(100)
-perform_select_table_operations_chicken(100)
-perform_delete_table_operations_pie(100)
-perform_update_table_operations(100)
-# write_results_to_excel(results, 'results.xlsx')
-with open('clickhouse_dict.json', 'w') as file:
-    json.dump(results, file, indent=4)
+def create_write_strategy_tables():
+    # Копии recipes на движках, где изменения выполняются вставками
+    try:
+        client.execute("DROP TABLE IF EXISTS recipes_replacing")
+        client.execute("""
+        CREATE TABLE recipes_replacing
+        (
+            title String,
+            ingredients Array(String),
+            directions Array(String),
+            link String,
+            source LowCardinality(String),
+            NER Array(String),
+            version UInt64,
+            is_deleted UInt8
+        ) ENGINE = ReplacingMergeTree(version, is_deleted) ORDER BY (title, link)
+        """)
+        client.execute("INSERT INTO recipes_replacing SELECT *, 1, 0 FROM recipes")
+        client.execute("DROP TABLE IF EXISTS recipes_collapsing")
+        client.execute("""
+        CREATE TABLE recipes_collapsing
+        (
+            title String,
+            ingredients Array(String),
+            directions Array(String),
+            link String,
+            source LowCardinality(String),
+            NER Array(String),
+            sign Int8
+        ) ENGINE = CollapsingMergeTree(sign) ORDER BY (title, link)
+        """)
+        client.execute("INSERT INTO recipes_collapsing SELECT *, 1 FROM recipes")
+        print("Write strategy tables created.")
+    except Exception as e:
+        print(f"Error creating write strategy tables: {e}")
+
+
+@measure_execution_time
+def run_write_strategy(strategy, operation):
+    configuration = write_strategies[strategy]
+    client.execute(configuration[operation], settings=configuration["settings"])
+    if configuration["poll"]:
+        wait_for_mutations(configuration["table"])
+
+
+def perform_write_strategy_operations(iterations: int) -> dict:
+    create_write_strategy_tables()
+    for table_name in {configuration["table"] for configuration in write_strategies.values()}:
+        create_template_table(table_name)
+    strategy_execution_times = {}
+    for strategy, configuration in write_strategies.items():
+        for operation in ('delete', 'update'):
+            if configuration[operation] is None:
+                continue
+            execution_times = []
+            for _ in range(iterations):
+                _, exec_time = run_write_strategy(strategy, operation)
+                reset_from_template(configuration["table"])
+                execution_times.append(exec_time)
+
+            results[f"{operation}_{strategy}"] = Measurement.store_results(
+                {"write_strategy": strategy}, execution_times, sample_name=f"{operation}_{strategy}")
+            strategy_execution_times[f"{operation}_{strategy}"] = execution_times
+
+    return strategy_execution_times
+
+
+def create_shard_clients(endpoints):
+    shard_clients = []
+    for endpoint in endpoints:
+        shard_host, shard_port = endpoint.rsplit(':', 1)
+        shard_clients.append(Client(host=shard_host, port=int(shard_port), user=user, database=database))
+    return shard_clients
+
+
+def create_sharded_tables(shard_clients):
+    # На каждом узле своя таблица recipes_local; Distributed создается только на координаторе
+    try:
+        for shard_client in shard_clients:
+            shard_client.execute("DROP TABLE IF EXISTS recipes_local")
+            shard_client.execute(recipes_table_query('base', 'recipes_local'))
+        if shard_cluster:
+            shard_clients[0].execute("DROP TABLE IF EXISTS recipes_distributed")
+            shard_clients[0].execute(f"""
+            CREATE TABLE recipes_distributed AS recipes_local
+            ENGINE = Distributed({shard_cluster}, currentDatabase(), recipes_local, {shard_key})
+            """)
+        print(f"Sharded tables created on {len(shard_clients)} shards.")
+    except Exception as e:
+        print(f"Error creating sharded tables: {e}")
+
+
+def sharded_table(shard_count, endpoints):
+    if shard_cluster and shard_count == len(endpoints):
+        return 'recipes_distributed'
+    return f"remote('{','.join(endpoints[:shard_count])}', currentDatabase(), recipes_local, {shard_key})"
+
+
+@measure_execution_time
+def insert_values_sharded(coordinator, table, rows, limit=None):
+    # Координатор делит строки по ключу шардирования и синхронно пишет части на узлы параллельно
+    target = f"FUNCTION {table}" if table.startswith('remote') else table
+    coordinator.execute(recipe_insert_query.replace('INTO recipes', f'INTO {target}'),
+                        rows if rows is not None else iter_csv(csv_file_path, limit),
+                        settings={"insert_distributed_sync": 1})
+
+
+@measure_execution_time
+def select_most_common_ner_sharded(coordinator, table):
+    # Каждый узел считает частичные частоты NER, координатор сливает их и выбирает топ-50
+    return coordinator.execute(select_most_common_ner_query.replace('FROM recipes', f'FROM {table}'))
+
+
+@measure_execution_time
+def select_recipes_chicken_parmesan_sharded(coordinator, table):
+    return coordinator.execute(select_chicken_parmesan_query.replace('FROM recipes', f'FROM {table}'))
+
+
+def perform_sharded_operations(iterations: int, limit: int, endpoints: list[str]) -> dict:
+    shard_clients = create_shard_clients(endpoints)
+    create_sharded_tables(shard_clients)
+    coordinator = shard_clients[0]
+    rows = load_rows(limit)
+    shard_counts = [1, len(endpoints)] if shard_cluster else range(1, len(endpoints) + 1)
+    sharded_execution_times = {}
+    for shard_count in shard_counts:
+        table = sharded_table(shard_count, endpoints)
+        execution_times = {"insert": [], "select_most_common_ner": [], "select_chicken_parmesan": []}
+        for _ in range(iterations):
+            for shard_client in shard_clients:
+                shard_client.execute("TRUNCATE TABLE recipes_local")
+            execution_times["insert"].append(insert_values_sharded(coordinator, table, rows, limit)[1])
+        for _ in range(iterations):
+            execution_times["select_most_common_ner"].append(select_most_common_ner_sharded(coordinator, table)[1])
+            execution_times["select_chicken_parmesan"].append(
+                select_recipes_chicken_parmesan_sharded(coordinator, table)[1])
+
+        rows_per_shard = [shard_client.execute("SELECT count() FROM recipes_local")[0][0]
+                          for shard_client in shard_clients[:shard_count]]
+        section = {"shards": shard_count, "table": 'Distributed' if table == 'recipes_distributed' else 'remote()',
+                   "recipes": sum(rows_per_shard), "rows_per_shard": ', '.join(map(str, rows_per_shard))}
+        for operation, times in execution_times.items():
+            summary = Measurement.summarize(times)
+            section[f"mean_time_{operation}"] = summary["mean_time"]
+            section[f"p99_time_{operation}"] = summary["p99"]
+        section["insert_rows_per_second"] = round(section["recipes"] / section["mean_time_insert"], 2) \
+            if section["mean_time_insert"] else 0
+        for operation in ("select_most_common_ner", "select_chicken_parmesan"):
+            section[f"{operation}_per_second"] = round(1 / section[f"mean_time_{operation}"], 2) \
+                if section[f"mean_time_{operation}"] else 0
+        results[f"sharded_{shard_count}"] = section
+        sharded_execution_times[shard_count] = execution_times
+
+    for shard_client in shard_clients:
+        shard_client.execute("DROP TABLE IF EXISTS recipes_local")
+        shard_client.disconnect()
+    return sharded_execution_times
+
+
+def use_query_cache(cache):
+    global query_cache
+    query_cache = cache
+
+
+def perform_query_cache_operations(iterations: int) -> dict:
+    previous_cache = query_cache
+    try:
+        report = Query_cache.perform_cache_operations(
+            'clickhouse',
+            {"select_most_common_ner": select_most_common_ner,
+             "select_chicken_parmesan": select_recipes_chicken_parmesan},
+            use_query_cache, lambda: Query_cache.invalidate(query_cache, 'recipes'), iterations)
+    finally:
+        use_query_cache(previous_cache)
+    for name, section in report.items():
+        results[f"query_cache_{name}"] = section
+    return report
+
+
+def run_crud_suite(limit: int, insert_iterations: int = 10, iterations: int = 100) -> dict:
+    return {
+        "insert": perform_insert_table_operations(insert_iterations, 'recipes', limit),
+        "select_most_common_ner": perform_select_table_operations_most_common(iterations),
+        "select_chicken_parmesan": perform_select_table_operations_chicken(iterations),
+        "delete": perform_delete_table_operations_pie(iterations),
+        "update": perform_update_table_operations(iterations),
+    }
+
+
+def collect_storage_footprint(table_name='recipes'):
+    # Размер активных кусков таблицы и ее столбцов; для ner_view добавляется таблица частот NER
+    tables = [table_name] + (['recipes_ner_counts'] if schema_variant == 'ner_view' else [])
+    parts_query = """
+    SELECT table, sum(rows), count(), sum(data_compressed_bytes), sum(data_uncompressed_bytes), sum(bytes_on_disk)
+    FROM system.parts
+    WHERE database = currentDatabase() AND table IN %(tables)s AND active
+    GROUP BY table
+    """
+    columns_query = """
+    SELECT name, type, data_compressed_bytes, data_uncompressed_bytes
+    FROM system.columns
+    WHERE database = currentDatabase() AND table = %(table)s
+    """
+    footprint = {"schema": schema_variant, "tables": {}, "columns": {}}
+    try:
+        for table, rows, parts, compressed, uncompressed, on_disk in client.execute(parts_query, {'tables': tuple(tables)}):
+            footprint["tables"][table] = {
+                "rows": rows, "parts": parts, "compressed_bytes": compressed,
+                "uncompressed_bytes": uncompressed, "bytes_on_disk": on_disk,
+            }
+        for name, column_type, compressed, uncompressed in client.execute(columns_query, {'table': table_name}):
+            footprint["columns"][name] = {
+                "type": column_type, "compressed_bytes": compressed, "uncompressed_bytes": uncompressed,
+                "compression_ratio": round(uncompressed / compressed, 2) if compressed else 0,
+            }
+    except Exception as e:
+        print(f"Error collecting storage footprint: {e}")
+        return footprint
+
+    recipes = footprint["tables"].get(table_name, {}).get("rows", 0)
+    bytes_on_disk = sum(table["bytes_on_disk"] for table in footprint["tables"].values())
+    footprint["recipes"] = recipes
+    footprint["bytes_on_disk"] = bytes_on_disk
+    footprint["uncompressed_bytes"] = sum(table["uncompressed_bytes"] for table in footprint["tables"].values())
+    footprint["bytes_per_recipe"] = round(bytes_on_disk / recipes, 2) if recipes else 0
+    footprint["uncompressed_bytes_per_recipe"] = round(footprint["uncompressed_bytes"] / recipes, 2) if recipes else 0
+    return footprint
+
+
+def perform_schema_variant_operations(limit: int):
+    # Прогоняем все операции на каждом варианте схемы; результаты base остаются в основных секциях,
+    # остальные варианты сохраняются в секциях с суффиксом варианта
+    base_sections = None
+    for variant in schema_variants:
+        drop_table_if_exists()
+        create_table(variant)
+        run_crud_suite(limit)
+        sections = {section: copy.deepcopy(results[section]) for section in ('insert', 'select', 'delete', 'update')}
+        # После delete/update таблица восстановлена из шаблона, поэтому замеряется исходный объем данных
+        sections["storage"] = collect_storage_footprint()
+        if variant == 'base':
+            base_sections = sections
+        else:
+            for section, values in sections.items():
+                results[f"{section}_{variant}"] = dict(values, schema=variant)
+    if base_sections:
+        results.update(base_sections)
+
+
+def perform_sweep_operations(sizes: list[int], iterations: int) -> dict:
+    # Полный набор CRUD на каждом размере набора данных (0 - весь файл) для построения кривых масштабирования.
+    # Кэш выборок на время прогона выключается, чтобы кривые отражали стоимость самих запросов
+    previous_cache = query_cache
+    use_query_cache(None)
+    sweep = {}
+    try:
+        for size in sizes:
+            print(f"Running CRUD suite on {Measurement.sweep_label(size)} rows")
+            execution_times = run_crud_suite(size or None, iterations, iterations)
+            # После delete/update таблица восстановлена из шаблона, поэтому count() равен числу вставленных строк;
+            # для всего набора оно заранее неизвестно
+            rows = client.execute("SELECT count() FROM recipes")[0][0]
+            sweep[Measurement.sweep_label(size)] = Measurement.summarize_sweep_point(rows, execution_times)
+            sweep[Measurement.sweep_label(size)]["bytes_per_recipe"] = collect_storage_footprint()["bytes_per_recipe"]
+    finally:
+        use_query_cache(previous_cache)
+    results["sweep"] = sweep
+    return sweep
+
+
+if __name__ == '__main__':
+    create_table()
+    if Measurement.sweep_sizes:
+        perform_sweep_operations(Measurement.sweep_sizes, Measurement.sweep_iterations)
+    else:
+        perform_insert_table_operations(10, 'recipes', 10000)
+        perform_insert_engine_operations(10, 'recipes', 10000)
+        perform_insert_parallel_ingest_operations(10, 'recipes', 10000)
+        perform_query_cache_operations(100)
+        perform_write_strategy_operations(100)
+        perform_schema_variant_operations(10000)
+        if shard_endpoints:
+            perform_sharded_operations(10, 10000, shard_endpoints)
+    Measurement.save_profiles('clickhouse')
+    # write_results_to_excel(results, 'results.xlsx')
+    with open('clickhouse_dict.json', 'w') as file:
+        json.dump(results, file, indent=4)
 
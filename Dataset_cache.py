@@ -0,0 +1,123 @@
+import csv
+import hashlib
+import json
+import os
+
+import pyarrow as pa
+
+# Кэш разобранного CSV в формате Arrow IPC: CSV разбирается один раз, дальше файл
+# открывается через memory map и читается без копирования.
+# Имя файла кэша строится из хэша исходного файла и ограничения на количество строк.
+RECIPE_COLUMNS = ('title', 'ingredients', 'directions', 'link', 'source', 'NER')
+LIST_COLUMNS = ('ingredients', 'directions', 'NER')
+
+RECIPE_SCHEMA = pa.schema([
+    ('title', pa.string()),
+    ('ingredients', pa.list_(pa.string())),
+    ('directions', pa.list_(pa.string())),
+    ('link', pa.string()),
+    ('source', pa.string()),
+    ('NER', pa.list_(pa.string())),
+])
+
+cache_directory = os.path.join('dataset', 'cache')
+
+# Хэши исходных файлов, чтобы не перечитывать большой CSV при каждом обращении к кэшу
+_file_hashes = {}
+
+
+def parse_recipe_row(row):
+    return {
+        column: json.loads(row[column]) if column in LIST_COLUMNS else row[column].strip()
+        for column in RECIPE_COLUMNS
+    }
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    file_stat = os.stat(file_path)
+    signature = (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns)
+    if signature not in _file_hashes:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        _file_hashes[signature] = digest.hexdigest()
+    return _file_hashes[signature]
+
+
+def cache_path(file_path, limit=None):
+    return os.path.join(cache_directory, f"{file_hash(file_path)}_{limit or 'all'}.arrow")
+
+
+def write_batches(path, batches):
+    # Пишем во временный файл и переименовываем, чтобы не оставить недописанный кэш
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = path + '.tmp'
+    with pa.OSFile(temporary_path, 'wb') as sink, pa.ipc.new_file(sink, RECIPE_SCHEMA) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(temporary_path, path)
+    return path
+
+
+def iter_csv_batches(file_path, limit=None, batch_size=50000):
+    with open(file_path, mode='r', encoding='utf-8', newline='') as file:
+        csv_reader = csv.DictReader(file)
+        columns = {column: [] for column in RECIPE_COLUMNS}
+        for idx, row in enumerate(csv_reader):
+            if limit and idx >= limit:
+                break
+            try:
+                recipe = parse_recipe_row(row)
+            except json.JSONDecodeError as e:
+                print(f"Error decoding JSON for row {idx}: {e}")
+                continue
+            for column in RECIPE_COLUMNS:
+                columns[column].append(recipe[column])
+            if len(columns['title']) >= batch_size:
+                yield pa.record_batch(columns, schema=RECIPE_SCHEMA)
+                columns = {column: [] for column in RECIPE_COLUMNS}
+        if columns['title']:
+            yield pa.record_batch(columns, schema=RECIPE_SCHEMA)
+
+
+def build_cache(file_path, limit=None):
+    path = cache_path(file_path, limit)
+    if not os.path.exists(path):
+        print(f"Building dataset cache {path}")
+        write_batches(path, iter_csv_batches(file_path, limit))
+    return path
+
+
+def is_arrow(file_path):
+    # Готовый файл .arrow (например, синтетический набор) можно передать напрямую вместо CSV,
+    # но читается он только через кэш: разбор CSV и конвейер Parallel_ingest к нему неприменимы
+    return file_path.endswith('.arrow')
+
+
+def load_table(file_path, limit=None):
+    path = file_path if is_arrow(file_path) else build_cache(file_path, limit)
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    if is_arrow(file_path) and limit:
+        table = table.slice(0, limit)
+    return table
+
+
+def iter_recipes(file_path, limit=None):
+    # Читаем кэш по одной пачке без memory map, чтобы память не росла вместе с размером набора
+    path = file_path if is_arrow(file_path) else build_cache(file_path, limit)
+    emitted = 0
+    with pa.OSFile(path, 'rb') as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            for recipe in reader.get_batch(index).to_pylist():
+                if limit and emitted >= limit:
+                    return
+                yield recipe
+                emitted += 1
+
+
+def load_columns(file_path, limit=None):
+    table = load_table(file_path, limit)
+    return [table.column(column).to_pylist() for column in RECIPE_COLUMNS]
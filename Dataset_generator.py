@@ -0,0 +1,245 @@
+import json
+import os
+import time
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+import Dataset_cache
+from os import getenv
+from dotenv import load_dotenv, find_dotenv
+
+# Генератор синтетического набора рецептов со схемой RecipeNLG: title, ingredients, directions, link, source, NER.
+# Все столбцы собираются векторно из словарей через NumPy и Arrow, поэтому в Python нет цикла по строкам.
+# Результат пишется в CSV (тот же формат, что dataset/full_dataset.csv) или сразу в кэш .arrow
+load_dotenv(find_dotenv())
+synthetic_rows = int(getenv("SYNTHETIC_ROWS", "1000000"))
+synthetic_output = getenv("SYNTHETIC_OUTPUT", os.path.join('dataset', 'synthetic_dataset.csv'))
+synthetic_seed = int(getenv("SYNTHETIC_SEED", "42"))
+synthetic_batch_size = int(getenv("SYNTHETIC_BATCH_SIZE", "500000"))
+# Пачки генерируются параллельно в пуле процессов; у каждой пачки свой поток случайных чисел
+# от (seed, номер первой строки), поэтому результат не зависит от количества процессов
+synthetic_workers = int(getenv("SYNTHETIC_WORKERS", "0")) or os.cpu_count() or 1
+# Словарь NER и распределение Ципфа: частота i-го по популярности слова пропорциональна 1 / i ** s
+synthetic_vocabulary_size = int(getenv("SYNTHETIC_VOCABULARY_SIZE", "2000"))
+synthetic_zipf_exponent = float(getenv("SYNTHETIC_ZIPF_EXPONENT", "1.1"))
+# Средние длины списков: количество ингредиентов (NER) и шагов приготовления (распределение Пуассона, минимум 1)
+synthetic_mean_ner = float(getenv("SYNTHETIC_MEAN_NER", "8"))
+synthetic_mean_directions = float(getenv("SYNTHETIC_MEAN_DIRECTIONS", "6"))
+# Доли строк, на которые срабатывают операции бенчмарка: title с 'pie' (delete),
+# title 'Baked Chicken Parmesan' (select) и 'water' в NER (update)
+synthetic_pie_fraction = float(getenv("SYNTHETIC_PIE_FRACTION", "0.03"))
+synthetic_chicken_fraction = float(getenv("SYNTHETIC_CHICKEN_FRACTION", "0.0001"))
+synthetic_water_fraction = float(getenv("SYNTHETIC_WATER_FRACTION", "0.2"))
+
+base_ingredients = [
+    'salt', 'sugar', 'butter', 'flour', 'eggs', 'milk', 'onion', 'garlic', 'pepper', 'vanilla',
+    'baking powder', 'baking soda', 'oil', 'cream cheese', 'sour cream', 'cheese', 'tomatoes', 'lemon juice',
+    'chicken', 'beef', 'pork', 'rice', 'celery', 'carrots', 'potatoes', 'mushrooms', 'parsley', 'cinnamon',
+    'nutmeg', 'honey', 'mayonnaise', 'mustard', 'vinegar', 'soy sauce', 'ginger', 'oregano', 'basil', 'thyme',
+    'paprika', 'cumin', 'broth', 'cream', 'nuts', 'pecans', 'walnuts', 'raisins', 'chocolate', 'cocoa',
+    'oats', 'bacon', 'ham', 'shrimp', 'beans', 'corn', 'peas', 'spinach', 'zucchini', 'apples', 'bananas',
+    'strawberries',
+]
+ingredient_modifiers = [
+    'brown', 'white', 'fresh', 'dried', 'ground', 'chopped', 'sliced', 'frozen', 'canned', 'shredded',
+    'grated', 'minced', 'powdered', 'light', 'dark', 'sweet', 'smoked', 'roasted', 'toasted', 'crushed',
+    'whole', 'low-fat', 'unsalted', 'organic', 'red', 'green', 'yellow', 'black', 'wild', 'baby',
+]
+quantities = ['1', '2', '3', '4', '1/2', '1/4', '3/4', '1 1/2', '2 1/2', '6', '8', '12']
+units = ['c.', 'tsp.', 'Tbsp.', 'oz.', 'lb.', 'pkg.', 'can', 'cloves', 'large', 'medium', 'small', 'pinch']
+title_adjectives = [
+    'Easy', 'Quick', 'Classic', 'Homemade', 'Spicy', 'Creamy', 'Crispy', 'Grandma\'s', 'Old-Fashioned', 'Simple',
+    'Healthy', 'Savory', 'Sweet', 'Cheesy', 'Golden', 'Roasted', 'Grilled', 'Baked', 'Slow Cooker', 'Holiday',
+]
+title_dishes = [
+    'Casserole', 'Salad', 'Soup', 'Cake', 'Cookies', 'Bread', 'Muffins', 'Stew', 'Dip', 'Bars',
+    'Sauce', 'Skillet', 'Bake', 'Stir-Fry', 'Chili', 'Dressing', 'Squares', 'Loaf', 'Fudge', 'Delight',
+]
+direction_verbs = ['Mix', 'Combine', 'Stir in', 'Add', 'Beat', 'Fold in', 'Whisk', 'Pour over', 'Sprinkle with',
+                   'Bake at 350 degrees for 30 minutes with', 'Simmer with', 'Cook with', 'Chill with', 'Serve with']
+direction_objects = ['the remaining ingredients', 'the dry ingredients', 'the mixture', 'the batter', 'the sauce',
+                     'the topping', 'the vegetables', 'the meat', 'the dough', 'the filling']
+sources = ['Gathered', 'Recipes1M']
+source_weights = [0.55, 0.45]
+
+
+def ner_vocabulary(size):
+    # Популярные ингредиенты идут первыми, затем сочетания с модификаторами и нумерованные приправы.
+    # 'water' и все, что содержит 'pie', исключены: их доли задаются только параметрами генератора
+    vocabulary = list(base_ingredients)
+    vocabulary += [f"{modifier} {ingredient}" for ingredient in base_ingredients for modifier in ingredient_modifiers]
+    vocabulary += [f"spice blend {number}" for number in range(max(0, size - len(vocabulary)))]
+    return [word for word in vocabulary if 'water' not in word and 'pie' not in word][:size]
+
+
+def zipf_cdf(size, exponent):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return np.cumsum(weights) / weights.sum()
+
+
+def quoted(array):
+    # Строки словарей без кавычек и обратных слэшей, поэтому для JSON достаточно обернуть их в кавычки
+    return pc.binary_join_element_wise('"', array, '"', '')
+
+
+def json_lists(values, offsets):
+    # Из плоского массива строк и смещений строк собираем JSON-массивы вида ["a", "b"], как в RecipeNLG
+    items = pa.ListArray.from_arrays(offsets, quoted(values))
+    return pc.binary_join_element_wise('[', pc.binary_join(items, ', '), ']', '')
+
+
+class RecipeGenerator:
+    def __init__(self, seed=synthetic_seed, vocabulary_size=synthetic_vocabulary_size,
+                 zipf_exponent=synthetic_zipf_exponent, mean_ner=synthetic_mean_ner,
+                 mean_directions=synthetic_mean_directions, pie_fraction=synthetic_pie_fraction,
+                 chicken_fraction=synthetic_chicken_fraction, water_fraction=synthetic_water_fraction):
+        self.seed = seed
+        vocabulary = ner_vocabulary(vocabulary_size)
+        # 'water' добавляется последним, вне распределения Ципфа
+        self.water_id = len(vocabulary)
+        self.ner_words = pa.array(vocabulary + ['water'])
+        self.title_words = pa.array([word.title() for word in vocabulary])
+        self.ner_cdf = zipf_cdf(len(vocabulary), zipf_exponent)
+        self.quantity_unit = pa.array([f"{quantity} {unit}" for quantity in quantities for unit in units])
+        self.adjectives = pa.array(title_adjectives)
+        self.dishes = pa.array(title_dishes)
+        self.directions = pa.array([f"{verb} {obj}." for verb in direction_verbs for obj in direction_objects])
+        self.sources = pa.array(sources)
+        self.mean_ner = mean_ner
+        self.mean_directions = mean_directions
+        self.pie_fraction = pie_fraction
+        self.chicken_fraction = chicken_fraction
+        self.water_fraction = water_fraction
+
+    def list_lengths(self, rows, mean):
+        return np.maximum(self.rng.poisson(mean, rows), 1)
+
+    def offsets(self, lengths):
+        return pa.array(np.concatenate(([0], np.cumsum(lengths))).astype(np.int32))
+
+    def sample_ner(self, rows):
+        lengths = self.list_lengths(rows, self.mean_ner)
+        ner_ids = np.searchsorted(self.ner_cdf, self.rng.random(lengths.sum()))
+        # В выбранных строках первый элемент NER заменяется на 'water'
+        row_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        water_rows = self.rng.random(rows) < self.water_fraction
+        ner_ids[row_starts[water_rows]] = self.water_id
+        # Выборка идет с возвращением, а в RecipeNLG каждый термин встречается в рецепте один раз:
+        # оставляем первое вхождение пары (строка, термин), порядок элементов сохраняется
+        element_rows = np.repeat(np.arange(rows), lengths)
+        _, first_elements = np.unique(element_rows * len(self.ner_words) + ner_ids, return_index=True)
+        first_elements.sort()
+        return np.bincount(element_rows[first_elements], minlength=rows), ner_ids[first_elements]
+
+    def titles(self, rows):
+        main_words = self.title_words.take(pa.array(np.searchsorted(self.ner_cdf, self.rng.random(rows))))
+        draws = self.rng.random(rows)
+        pie_rows = draws < self.pie_fraction
+        chicken_rows = (draws >= self.pie_fraction) & (draws < self.pie_fraction + self.chicken_fraction)
+        dishes = pc.if_else(pa.array(pie_rows), 'pie',
+                            self.dishes.take(pa.array(self.rng.integers(0, len(self.dishes), rows))))
+        titles = pc.binary_join_element_wise(
+            self.adjectives.take(pa.array(self.rng.integers(0, len(self.adjectives), rows))),
+            main_words, dishes, ' ')
+        return pc.if_else(pa.array(chicken_rows), 'Baked Chicken Parmesan', titles)
+
+    def columns(self, start, rows):
+        self.rng = np.random.default_rng([self.seed, start])
+        ner_lengths, ner_ids = self.sample_ner(rows)
+        ner_values = self.ner_words.take(pa.array(ner_ids))
+        ner_offsets = self.offsets(ner_lengths)
+        # Ингредиенты соответствуют NER по порядку: "<количество> <единица> <ингредиент>"
+        ingredient_values = pc.binary_join_element_wise(
+            self.quantity_unit.take(pa.array(self.rng.integers(0, len(self.quantity_unit), len(ner_ids)))),
+            ner_values, ' ')
+        direction_lengths = self.list_lengths(rows, self.mean_directions)
+        direction_values = self.directions.take(
+            pa.array(self.rng.integers(0, len(self.directions), direction_lengths.sum())))
+        row_ids = pa.array(np.arange(start, start + rows))
+        return {
+            'row_id': row_ids,
+            'title': self.titles(rows),
+            'ingredients': (ingredient_values, ner_offsets),
+            'directions': (direction_values, self.offsets(direction_lengths)),
+            'link': pc.binary_join_element_wise('www.synthetic-recipes.com/recipe/', pc.cast(row_ids, pa.string()), ''),
+            'source': self.sources.take(pa.array(self.rng.choice(len(self.sources), rows, p=source_weights))),
+            'NER': (ner_values, ner_offsets),
+        }
+
+    def record_batch(self, start, rows):
+        # Пачка для кэша .arrow в схеме Dataset_cache.RECIPE_SCHEMA
+        columns = self.columns(start, rows)
+        return pa.record_batch([
+            columns[column] if column not in Dataset_cache.LIST_COLUMNS
+            else pa.ListArray.from_arrays(columns[column][1], columns[column][0])
+            for column in Dataset_cache.RECIPE_COLUMNS
+        ], schema=Dataset_cache.RECIPE_SCHEMA)
+
+    def csv_batch(self, start, rows):
+        # Пачка для CSV: первый безымянный столбец - номер строки, списки записаны JSON-строками
+        columns = self.columns(start, rows)
+        arrays = [columns['row_id']] + [
+            columns[column] if column not in Dataset_cache.LIST_COLUMNS else json_lists(*columns[column])
+            for column in Dataset_cache.RECIPE_COLUMNS
+        ]
+        return pa.record_batch(arrays, names=[''] + list(Dataset_cache.RECIPE_COLUMNS))
+
+
+
+def build_batch(options, output_format, start, rows):
+    generator = RecipeGenerator(**options)
+    return generator.record_batch(start, rows) if output_format == 'arrow' else generator.csv_batch(start, rows)
+
+
+def iter_generated_batches(output_format, rows, batch_size, workers, options):
+    ranges = [(start, min(batch_size, rows - start)) for start in range(0, rows, batch_size)]
+    if workers == 1:
+        for start, batch_rows in ranges:
+            yield build_batch(options, output_format, start, batch_rows)
+        return
+    # Вперед запускается не больше двух пачек на процесс, чтобы память не росла, пока писатель занят
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, batch_rows in ranges:
+            pending.append(executor.submit(build_batch, options, output_format, start, batch_rows))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def generate_dataset(path=synthetic_output, rows=synthetic_rows, batch_size=synthetic_batch_size,
+                     workers=synthetic_workers, **options):
+    if path.endswith('.arrow'):
+        return Dataset_cache.write_batches(path, iter_generated_batches('arrow', rows, batch_size, workers, options))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = path + '.tmp'
+    batches = iter_generated_batches('csv', rows, batch_size, workers, options)
+    first_batch = next(batches)
+    with pa_csv.CSVWriter(temporary_path, first_batch.schema) as writer:
+        writer.write_batch(first_batch)
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(temporary_path, path)
+    return path
+
+
+if __name__ == '__main__':
+    start_time = time.perf_counter()
+    output_path = generate_dataset()
+    elapsed = time.perf_counter() - start_time
+    print(f"Generated {synthetic_rows} recipes into {output_path} in {elapsed:.2f} s "
+          f"({synthetic_rows / elapsed:,.0f} rows/s)")
+    with open(output_path + '.json', 'w') as file:
+        json.dump({
+            "rows": synthetic_rows, "seed": synthetic_seed, "vocabulary_size": synthetic_vocabulary_size,
+            "zipf_exponent": synthetic_zipf_exponent, "mean_ner": synthetic_mean_ner,
+            "mean_directions": synthetic_mean_directions, "pie_fraction": synthetic_pie_fraction,
+            "chicken_fraction": synthetic_chicken_fraction, "water_fraction": synthetic_water_fraction,
+        }, file, indent=4)
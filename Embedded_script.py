@@ -0,0 +1,348 @@
+import json
+import csv
+import numpy as np
+import pandas as pd
+import Dataset_cache
+import Measurement
+from os import getenv
+from dotenv import load_dotenv, find_dotenv
+from Measurement import measure_execution_time
+
+
+# find the .env file and load it
+load_dotenv(find_dotenv())
+# Встроенное хранилище рецептов в памяти процесса: базовая линия без сети и без внешних сервисов
+use_dataset_cache = getenv("USE_DATASET_CACHE", "1") == "1"
+dataset_path = getenv("EMBEDDED_DATASET_PATH", 'dataset/full_dataset.csv')
+dataset_limit = int(getenv("EMBEDDED_LIMIT", "10000")) or None
+# Доля удаленных строк, после которой хранилище уплотняется
+compaction_ratio = float(getenv("EMBEDDED_COMPACTION_RATIO", "0.2"))
+
+results_embedded = {
+    "insert_embedded": {
+        "iterations": 0,
+        "total_execution_time": 0,
+        "mean_time": 0,
+        "variance_time": 0
+    },
+    "select_embedded": {
+        "iterations": 0,
+        "total_execution_time": 0,
+        "mean_time": 0,
+        "variance_time": 0,
+        "iterations_2": 0,
+        "total_execution_time_2": 0,
+        "mean_time_2": 0,
+        "variance_time_2": 0
+    },
+    "delete_embedded": {
+        "iterations": 0,
+        "total_execution_time": 0,
+        "mean_time": 0,
+        "variance_time": 0,
+    },
+    "update_embedded": {
+        "iterations": 0,
+        "total_execution_time": 0,
+        "mean_time": 0,
+        "variance_time": 0
+    },
+}
+
+
+class ListColumn:
+    # Столбец списков в стиле Arrow: плоский массив значений и смещения начала каждой строки
+    def __init__(self, values=None, offsets=None):
+        self.values = values if values is not None else np.empty(0, dtype=object)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def row(self, row_id):
+        return self.values[self.offsets[row_id]:self.offsets[row_id + 1]]
+
+    def element_mask(self, row_mask):
+        # Маска строк, развернутая до маски элементов
+        return np.repeat(row_mask, self.lengths())
+
+    def append(self, lists, dtype=object):
+        lengths = np.fromiter((len(items) for items in lists), dtype=np.int64, count=len(lists))
+        values = np.fromiter((item for items in lists for item in items), dtype=dtype, count=int(lengths.sum()))
+        self.values = np.concatenate((self.values, values))
+        self.offsets = np.concatenate((self.offsets, self.offsets[-1] + np.cumsum(lengths)))
+
+    def element_indices(self, row_ids):
+        # Индексы элементов выбранных строк: начало строки плюс позиция внутри нее, и длины этих строк
+        starts = self.offsets[row_ids]
+        lengths = self.offsets[np.asarray(row_ids) + 1] - starts
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(starts, lengths) + positions, lengths
+
+    def take(self, row_ids):
+        elements, lengths = self.element_indices(row_ids)
+        return ListColumn(self.values[elements], np.concatenate(([0], np.cumsum(lengths))).astype(np.int64))
+
+
+class RecipeStore:
+    # Колоночное хранилище шести полей рецепта с хэш-индексом по title, инвертированным индексом
+    # по NER (термин -> номера строк) и удалением через tombstone с последующим уплотнением
+    def __init__(self):
+        self.title = np.empty(0, dtype=object)
+        self.link = np.empty(0, dtype=object)
+        self.source = np.empty(0, dtype=object)
+        self.ingredients = ListColumn()
+        self.directions = ListColumn()
+        # NER хранится как номера терминов в словаре
+        self.ner = ListColumn(np.empty(0, dtype=np.int64))
+        self.ner_terms = []
+        self.ner_term_ids = {}
+        self.alive = np.empty(0, dtype=bool)
+        self.title_index = {}
+        self.ner_index = {}
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def term_id(self, term):
+        if term not in self.ner_term_ids:
+            self.ner_term_ids[term] = len(self.ner_terms)
+            self.ner_terms.append(term)
+        return self.ner_term_ids[term]
+
+    def insert(self, recipes):
+        recipes = list(recipes)
+        first_row = len(self.alive)
+        self.title = np.concatenate((self.title, np.array([recipe['title'] for recipe in recipes], dtype=object)))
+        self.link = np.concatenate((self.link, np.array([recipe['link'] for recipe in recipes], dtype=object)))
+        self.source = np.concatenate((self.source, np.array([recipe['source'] for recipe in recipes], dtype=object)))
+        self.ingredients.append([recipe['ingredients'] for recipe in recipes])
+        self.directions.append([recipe['directions'] for recipe in recipes])
+        ner_ids = [[self.term_id(term) for term in recipe['NER']] for recipe in recipes]
+        self.ner.append(ner_ids, dtype=np.int64)
+        self.alive = np.concatenate((self.alive, np.ones(len(recipes), dtype=bool)))
+        for row_id, (recipe, term_ids) in enumerate(zip(recipes, ner_ids), start=first_row):
+            self.title_index.setdefault(recipe['title'], []).append(row_id)
+            for term_id in term_ids:
+                self.ner_index.setdefault(term_id, []).append(row_id)
+        return len(recipes)
+
+    def most_common_ner(self, limit=50):
+        counts = np.bincount(self.ner.values[self.ner.element_mask(self.alive)], minlength=len(self.ner_terms))
+        top = np.argpartition(counts, -limit)[-limit:] if len(counts) > limit else np.arange(len(counts))
+        top = top[np.argsort(counts[top])[::-1]]
+        return [(self.ner_terms[term_id], int(counts[term_id])) for term_id in top if counts[term_id]]
+
+    def find_by_title(self, title):
+        return [row_id for row_id in self.title_index.get(title, ()) if self.alive[row_id]]
+
+    def rows_with_term(self, term):
+        term_id = self.ner_term_ids.get(term)
+        if term_id is None:
+            return np.empty(0, dtype=np.int64)
+        row_ids = np.unique(np.array(self.ner_index.get(term_id, ()), dtype=np.int64))
+        return row_ids[self.alive[row_ids]]
+
+    def delete_where_title_contains(self, substring):
+        matched = np.fromiter((substring in title.lower() for title in self.title), dtype=bool,
+                              count=len(self.title)) & self.alive
+        self.alive[matched] = False
+        for row_id in np.flatnonzero(matched):
+            self.title_index[self.title[row_id]].remove(row_id)
+        # Записи инвертированного индекса удаленных строк остаются до уплотнения и отфильтровываются по alive
+        if len(self.alive) and 1 - self.alive.mean() > compaction_ratio:
+            self.compact()
+        return int(matched.sum())
+
+    def replace_in_ner(self, term, replacement):
+        # Как в остальных скриптах: в строках, где есть термин, замена подстроки во всех элементах NER
+        row_ids = self.rows_with_term(term)
+        if not len(row_ids):
+            return 0
+        # Работаем только с элементами найденных строк, без масок по всему столбцу
+        elements, lengths = self.ner.element_indices(row_ids)
+        old_ids = self.ner.values[elements]
+        remap = np.arange(len(self.ner_terms))
+        for term_id in np.unique(old_ids):
+            if term in self.ner_terms[term_id]:
+                remap[term_id] = self.term_id(self.ner_terms[term_id].replace(term, replacement))
+        new_ids = remap[old_ids]
+        self.ner.values[elements] = new_ids
+        changed = old_ids != new_ids
+        element_rows = np.repeat(row_ids, lengths)
+        # Списки индекса перестраиваются целиком по каждому затронутому термину: поэлементный list.remove
+        # проходит весь список и делает обновление квадратичным по числу строк.
+        # remap действует на все вхождения термина в строке, поэтому строка уходит из старого списка полностью
+        changed_rows, old_ids, new_ids = element_rows[changed], old_ids[changed], new_ids[changed]
+        for old_id in np.unique(old_ids):
+            moved_rows = changed_rows[old_ids == old_id]
+            posting = np.array(self.ner_index[old_id], dtype=np.int64)
+            self.ner_index[old_id] = posting[~np.isin(posting, moved_rows)].tolist()
+        for new_id in np.unique(new_ids):
+            self.ner_index.setdefault(new_id, []).extend(changed_rows[new_ids == new_id].tolist())
+        return len(row_ids)
+
+    def compact(self):
+        live_rows = np.flatnonzero(self.alive)
+        self.title = self.title[live_rows]
+        self.link = self.link[live_rows]
+        self.source = self.source[live_rows]
+        self.ingredients = self.ingredients.take(live_rows)
+        self.directions = self.directions.take(live_rows)
+        self.ner = self.ner.take(live_rows)
+        self.alive = np.ones(len(live_rows), dtype=bool)
+        self.title_index = {}
+        for row_id, title in enumerate(self.title):
+            self.title_index.setdefault(title, []).append(row_id)
+        self.ner_index = {}
+        element_rows = np.repeat(np.arange(len(live_rows)), self.ner.lengths())
+        for row_id, term_id in zip(element_rows.tolist(), self.ner.values.tolist()):
+            self.ner_index.setdefault(term_id, []).append(row_id)
+
+
+store = RecipeStore()
+
+
+def write_results_to_excel(results, filename='results_embedded.xlsx'):
+    df = pd.DataFrame(results)
+    try:
+        df.to_excel(filename, index=True, header=True)
+        print(f"Results saved to {filename} successfully.")
+    except Exception as e:
+        print(f"Error saving results to Excel: {e}")
+
+
+def load_data_from_csv(file_path, limit=None):
+    if use_dataset_cache or Dataset_cache.is_arrow(file_path):
+        return list(Dataset_cache.iter_recipes(file_path, limit))
+    recipes = []
+    with open(file_path, mode='r', encoding='utf-8', newline='') as file:
+        for idx, row in enumerate(csv.DictReader(file)):
+            if limit and idx >= limit:
+                break
+            try:
+                recipes.append(Dataset_cache.parse_recipe_row(row))
+            except json.JSONDecodeError as e:
+                print(f"Error decoding JSON for row {idx}: {e}")
+    return recipes
+
+
+def restore_embedded_data(recipes):
+    global store
+    store = RecipeStore()
+    store.insert(recipes)
+
+
+@measure_execution_time
+def insert_data_to_embedded(recipes):
+    return store.insert(recipes)
+
+
+def perform_insert_table_operations(iterations: int, recipes) -> list[float]:
+    global store
+    execution_times = []
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        store = RecipeStore()
+        _, exec_time = insert_data_to_embedded(recipes)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+
+    Measurement.store_results(results_embedded["insert_embedded"], execution_times, sample_name="insert_embedded")
+
+    return execution_times
+
+
+@measure_execution_time
+def select_most_common_ner():
+    top_ner = store.most_common_ner(50)
+    for position, (ner_entity, count) in enumerate(top_ner, start=1):
+        Measurement.log(f"{position}: {ner_entity} {count}")
+    return top_ner
+
+
+def perform_select_table_operations_most_common(iterations: int) -> list[float]:
+    execution_times = []
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        _, exec_time = select_most_common_ner()
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+
+    # Порядок секций как в clickhouse_dict.json: без суффикса - топ NER, _2 - поиск по названию
+    Measurement.store_results(results_embedded["select_embedded"], execution_times, sample_name="select_embedded")
+
+    return execution_times
+
+
+@measure_execution_time
+def select_recipe_chicken_parmesan():
+    found = [store.directions.row(row_id).tolist() for row_id in store.find_by_title('Baked Chicken Parmesan')]
+    for directions in found:
+        Measurement.log(directions)
+    return found
+
+
+def perform_select_table_operations_chicken(iterations: int) -> list[float]:
+    execution_times = []
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        _, exec_time = select_recipe_chicken_parmesan()
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+
+    Measurement.store_results(results_embedded["select_embedded"], execution_times, '_2',
+                              sample_name="select_embedded_2")
+
+    return execution_times
+
+
+@measure_execution_time
+def delete_record_with_pie():
+    deleted = store.delete_where_title_contains('pie')
+    Measurement.log(f"Deleted {deleted} recipes")
+    return deleted
+
+
+def perform_delete_table_operations_pie(iterations: int, recipes) -> list[float]:
+    execution_times = []
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        _, exec_time = delete_record_with_pie()
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+        restore_embedded_data(recipes)
+
+    Measurement.store_results(results_embedded["delete_embedded"], execution_times, sample_name="delete_embedded")
+
+    return execution_times
+
+
+@measure_execution_time
+def update_ingredients_water_to_test():
+    updated = store.replace_in_ner('water', 'TEST')
+    Measurement.log(f"Updated {updated} recipes")
+    return updated
+
+
+def perform_update_table_operations(iterations: int, recipes) -> list[float]:
+    execution_times = []
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        _, exec_time = update_ingredients_water_to_test()
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+        restore_embedded_data(recipes)
+
+    Measurement.store_results(results_embedded["update_embedded"], execution_times, sample_name="update_embedded")
+
+    return execution_times
+
+
+if __name__ == '__main__':
+    # Данные читаются один раз до замеров: вставка в хранилище не включает разбор CSV
+    recipes = load_data_from_csv(dataset_path, dataset_limit)
+    perform_insert_table_operations(5, recipes)
+    perform_select_table_operations_most_common(100)
+    perform_select_table_operations_chicken(100)
+    perform_delete_table_operations_pie(100, recipes)
+    perform_update_table_operations(100, recipes)
+    Measurement.save_profiles('embedded')
+    write_results_to_excel(results_embedded)
+    with open('embedded_dict.json', 'w') as file:
+        json.dump(results_embedded, file, indent=4)
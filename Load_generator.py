@@ -0,0 +1,372 @@
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
+
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, count, islice
+from os import getenv
+
+import Clickhouse_script
+import Measurement
+import Query_cache
+import Redis_script
+from clickhouse_driver import Client
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# Генератор нагрузки: N параллельных исполнителей выполняют смесь операций CRUD.
+# closed - каждый исполнитель запускает следующую операцию сразу после предыдущей,
+# open - операции приходят с фиксированной частотой load_target_qps, и задержка считается
+# от запланированного момента старта, поэтому ожидание в очереди тоже попадает в замер
+load_backends = getenv("LOAD_BACKENDS", "redis,clickhouse").split(',')
+load_worker_counts = [int(workers) for workers in getenv("LOAD_WORKERS", "1,2,4,8,16").split(',')]
+load_mode = getenv("LOAD_MODE", "closed")
+load_target_qps = float(getenv("LOAD_TARGET_QPS", "50"))
+load_duration = float(getenv("LOAD_DURATION", "30"))
+load_insert_rows = int(getenv("LOAD_INSERT_ROWS", "100"))
+load_mix = {
+    name: float(weight)
+    for name, weight in (
+        item.split(':') for item in getenv(
+            "LOAD_MIX",
+            "select_most_common_ner:0.45,select_chicken_parmesan:0.45,insert:0.05,update:0.025,delete:0.025"
+        ).split(',')
+    )
+}
+
+results_load = {}
+
+
+class LoadState:
+    def __init__(self, mix, insert_recipes):
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.insert_recipes = insert_recipes
+        self.insert_counter = count()
+
+    def pick_operation(self):
+        return random.choices(self.operations, self.weights)[0]
+
+    def next_insert_batch(self):
+        start = next(self.insert_counter) * load_insert_rows
+        return [(start + offset, self.insert_recipes[(start + offset) % len(self.insert_recipes)])
+                for offset in range(load_insert_rows)]
+
+
+class LoadRecorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, name, elapsed_ns, error):
+        with self.lock:
+            if error:
+                self.errors[name] += 1
+            else:
+                self.samples[name].append(elapsed_ns / 1e9)
+
+    def report(self, elapsed):
+        completed = sum(len(samples) for samples in self.samples.values())
+        report = {
+            "duration": round(elapsed, 3),
+            "completed": completed,
+            "errors": sum(self.errors.values()),
+            "achieved_qps": round(completed / elapsed, 2) if elapsed else 0,
+        }
+        if completed:
+            report.update(Measurement.summarize(list(chain.from_iterable(self.samples.values()))))
+        report["operations"] = {
+            name: dict(Measurement.summarize(samples) if samples else {}, errors=self.errors[name])
+            for name, samples in self.samples.items()
+        }
+        for name in self.errors.keys() - self.samples.keys():
+            report["operations"][name] = {"errors": self.errors[name]}
+        return report
+
+
+async def redis_scan(redis_client, path):
+    cursor = 0
+    while True:
+        cursor, keys = await redis_client.scan(cursor=cursor, match='recipe:*', count=Redis_script.scan_chunk_size)
+        if keys:
+            values = await redis_client.execute_command('JSON.MGET', *keys, path)
+            for key, value in zip(keys, values):
+                decoded = json.loads(value) if value else None
+                if decoded:
+                    yield key, decoded[0]
+        if int(cursor) == 0:
+            break
+
+
+async def redis_select_most_common_ner(redis_client, state):
+    ner_counts = Counter()
+    async for _, ner_list in redis_scan(redis_client, '$.NER'):
+        ner_counts.update(ner_list)
+    return ner_counts.most_common(50)
+
+
+async def redis_select_chicken_parmesan(redis_client, state):
+    directions = []
+    async for key, title in redis_scan(redis_client, '$.title'):
+        if title == 'Baked Chicken Parmesan':
+            directions.append(json.loads(await redis_client.execute_command('JSON.GET', key, '$.directions'))[0])
+    return directions
+
+
+async def redis_insert(redis_client, state):
+    pipe = redis_client.pipeline(transaction=False)
+    for idx, recipe in state.next_insert_batch():
+        pipe.execute_command('JSON.SET', f"recipe:load:{idx}", '$', Redis_script.serialize_recipe(recipe))
+    await pipe.execute()
+    invalidate_recipes()
+
+
+async def redis_delete(redis_client, state):
+    keys = [key async for key, title in redis_scan(redis_client, '$.title') if 'pie' in title.lower()]
+    for start in range(0, len(keys), Redis_script.scan_chunk_size):
+        await redis_client.delete(*keys[start:start + Redis_script.scan_chunk_size])
+    invalidate_recipes()
+
+
+async def redis_update(redis_client, state):
+    pipe = redis_client.pipeline(transaction=False)
+    async for key, ner_list in redis_scan(redis_client, '$.NER'):
+        if 'water' in ner_list:
+            updated_ner = [ner.replace('water', 'TEST') for ner in ner_list]
+            pipe.execute_command('JSON.SET', key, '$.NER', Redis_script.serialize_recipe(updated_ner))
+    await pipe.execute()
+    invalidate_recipes()
+
+
+redis_operations = {
+    "select_most_common_ner": redis_select_most_common_ner,
+    "select_chicken_parmesan": redis_select_chicken_parmesan,
+    "insert": redis_insert,
+    "delete": redis_delete,
+    "update": redis_update,
+}
+
+
+def invalidate_recipes():
+    Query_cache.invalidate(Redis_script.query_cache, 'recipes')
+
+
+# Синхронные операции записи идут через пакетные функции Redis_script, поэтому индексы
+# и кэш выборок поддерживаются так же, как при обычном прогоне
+def redis_sync_insert(redis_client, state):
+    Redis_script.write_recipe_batch([(f"recipe:load:{idx}", recipe) for idx, recipe in state.next_insert_batch()])
+    invalidate_recipes()
+
+
+def redis_sync_delete(redis_client, state):
+    pie_keys = (key for key, title in Redis_script.scan_recipes('$.title') if 'pie' in title.lower())
+    for keys in Redis_script.iter_batches(pie_keys, Redis_script.scan_chunk_size):
+        Redis_script.delete_recipe_batch(keys)
+    invalidate_recipes()
+
+
+def redis_sync_update(redis_client, state):
+    water_recipes = ((key, ner_list) for key, ner_list in Redis_script.scan_recipes('$.NER') if 'water' in ner_list)
+    for batch in Redis_script.iter_batches(water_recipes, Redis_script.scan_chunk_size):
+        Redis_script.update_ner_batch(batch, 'water', 'TEST')
+    invalidate_recipes()
+
+
+redis_sync_operations = {
+    "select_most_common_ner":
+        lambda redis_client, state: Counter(
+            chain.from_iterable(ner_list for _, ner_list in Redis_script.scan_recipes('$.NER'))).most_common(50),
+    "select_chicken_parmesan":
+        lambda redis_client, state: [directions for key, title in Redis_script.scan_recipes('$.title')
+                                     if title == 'Baked Chicken Parmesan'
+                                     for _, directions in Redis_script.fetch_recipes([key], '$.directions')],
+    "insert": redis_sync_insert,
+    "delete": redis_sync_delete,
+    "update": redis_sync_update,
+}
+
+
+def clickhouse_mutation_settings():
+    return {"mutations_sync": 2} if Clickhouse_script.mutation_wait_mode != 'async' else None
+
+
+clickhouse_operations = {
+    "select_most_common_ner":
+        lambda client, state: client.execute(Clickhouse_script.most_common_ner_query()),
+    "select_chicken_parmesan":
+        lambda client, state: client.execute(Clickhouse_script.select_chicken_parmesan_query),
+    "insert":
+        lambda client, state: client.execute(Clickhouse_script.recipe_insert_query,
+                                             [recipe for _, recipe in state.next_insert_batch()]),
+    "delete":
+        lambda client, state: client.execute(Clickhouse_script.delete_mutation_query,
+                                             settings=clickhouse_mutation_settings()),
+    "update":
+        lambda client, state: client.execute(Clickhouse_script.update_mutation_query,
+                                             settings=clickhouse_mutation_settings()),
+}
+
+
+async def run_redis_load(workers, mode, duration, target_qps, state):
+    redis_client = aioredis.Redis(host=Redis_script.host, port=Redis_script.port,
+                                  decode_responses=True, max_connections=workers)
+    recorder = LoadRecorder()
+    started_ns = time.perf_counter_ns()
+    deadline_ns = started_ns + int(duration * 1e9)
+
+    async def call(name, scheduled_ns=None):
+        start_ns = scheduled_ns or time.perf_counter_ns()
+        try:
+            await redis_operations[name](redis_client, state)
+            error = False
+        except Exception as e:
+            print(f"Error executing {name}: {e}")
+            error = True
+        recorder.record(name, time.perf_counter_ns() - start_ns, error)
+
+    if mode == 'closed':
+        async def worker():
+            while time.perf_counter_ns() < deadline_ns:
+                await call(state.pick_operation())
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    else:
+        # Число одновременно выполняемых запросов ограничено количеством исполнителей
+        semaphore = asyncio.Semaphore(workers)
+
+        async def request(name, scheduled_ns):
+            async with semaphore:
+                await call(name, scheduled_ns)
+
+        tasks = []
+        for arrival in count():
+            scheduled_ns = started_ns + int(arrival / target_qps * 1e9)
+            if scheduled_ns >= deadline_ns:
+                break
+            delay = (scheduled_ns - time.perf_counter_ns()) / 1e9
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(request(state.pick_operation(), scheduled_ns)))
+        await asyncio.gather(*tasks)
+
+    elapsed = (time.perf_counter_ns() - started_ns) / 1e9
+    await redis_client.close()
+    return recorder.report(elapsed)
+
+
+def run_threaded_load(workers, mode, duration, target_qps, state, operations, connections):
+    # connections - очередь соединений; каждый поток берет свое на время операции
+    recorder = LoadRecorder()
+    started_ns = time.perf_counter_ns()
+    deadline_ns = started_ns + int(duration * 1e9)
+
+    def call(name, scheduled_ns=None):
+        start_ns = scheduled_ns or time.perf_counter_ns()
+        connection = connections.get()
+        try:
+            operations[name](connection, state)
+            error = False
+        except Exception as e:
+            print(f"Error executing {name}: {e}")
+            error = True
+        finally:
+            connections.put(connection)
+        recorder.record(name, time.perf_counter_ns() - start_ns, error)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if mode == 'closed':
+            def worker():
+                while time.perf_counter_ns() < deadline_ns:
+                    call(state.pick_operation())
+
+            futures = [executor.submit(worker) for _ in range(workers)]
+        else:
+            futures = []
+            for arrival in count():
+                scheduled_ns = started_ns + int(arrival / target_qps * 1e9)
+                if scheduled_ns >= deadline_ns:
+                    break
+                delay = (scheduled_ns - time.perf_counter_ns()) / 1e9
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(call, state.pick_operation(), scheduled_ns))
+        for future in futures:
+            future.result()
+
+    return recorder.report((time.perf_counter_ns() - started_ns) / 1e9)
+
+
+def run_clickhouse_load(workers, mode, duration, target_qps, state):
+    # Пул соединений: clickhouse_driver.Client не потокобезопасен, поэтому у каждого потока свое
+    connections = queue.Queue()
+    clients = [Client(host=Clickhouse_script.host, port=Clickhouse_script.port,
+                      user=Clickhouse_script.user, database=Clickhouse_script.database)
+               for _ in range(workers)]
+    for client in clients:
+        connections.put(client)
+    try:
+        return run_threaded_load(workers, mode, duration, target_qps, state, clickhouse_operations, connections)
+    finally:
+        for client in clients:
+            client.disconnect()
+
+
+def run_redis_threaded_load(workers, mode, duration, target_qps, state):
+    # Запасной вариант для redis<4.2 (rejson 0.5.6 фиксирует redis==3.5.3): пул соединений
+    # redis-py потокобезопасен, поэтому все потоки используют общий клиент
+    connections = queue.Queue()
+    for _ in range(workers):
+        connections.put(Redis_script.redis_client)
+    return run_threaded_load(workers, mode, duration, target_qps, state, redis_sync_operations, connections)
+
+
+def perform_load_operations(backend, worker_counts, mode=load_mode, duration=load_duration,
+                            target_qps=load_target_qps, mix=None):
+    insert_recipes = list(islice(Redis_script.recipe_source(), 1000))
+    state = LoadState(mix or load_mix, insert_recipes)
+    backend_results = {}
+    if backend == 'clickhouse':
+        # Исходное состояние recipes сохраняется в шаблон и возвращается перед каждым уровнем
+        Clickhouse_script.create_template_table()
+    for workers in worker_counts:
+        print(f"Running {mode}-loop load on {backend} with {workers} workers")
+        if backend == 'redis':
+            # Каждый прогон начинается с исходного набора: ключи recipe:load:* и изменения
+            # предыдущего прогона удаляются вместе с индексами
+            Redis_script.restore_redis_data()
+            # Асинхронные операции читают и пишут RedisJSON напрямую, минуя кодек, и не ведут индексы на клиенте,
+            # поэтому используются только для формата json без индексов; иначе - потоки поверх Redis_script
+            if aioredis is not None and Redis_script.codec.name == 'json' and not Redis_script.indexes_enabled():
+                report = asyncio.run(run_redis_load(workers, mode, duration, target_qps, state))
+            else:
+                report = run_redis_threaded_load(workers, mode, duration, target_qps, state)
+        else:
+            # Смесь удаляет строки 'pie', меняет 'water' и добавляет строки, поэтому каждый уровень
+            # начинается с той же таблицы
+            Clickhouse_script.reset_from_template()
+            report = run_clickhouse_load(workers, mode, duration, target_qps, state)
+        report["mode"] = mode
+        report["target_qps"] = target_qps if mode == 'open' else None
+        backend_results[f"concurrency_{workers}"] = report
+    if backend == 'redis':
+        # Вставленные нагрузкой ключи попадают под шаблон recipe:*, их не должно остаться для следующих замеров
+        Redis_script.restore_redis_data()
+    else:
+        Clickhouse_script.reset_from_template()
+    results_load[backend] = backend_results
+    return backend_results
+
+
+if __name__ == '__main__':
+    for backend in load_backends:
+        perform_load_operations(backend, load_worker_counts)
+    with open('load_dict.json', 'w') as file:
+        json.dump(results_load, file, indent=4)
@@ -0,0 +1,242 @@
+import cProfile
+import io
+import math
+import os
+import pstats
+import statistics
+import threading
+import time
+import tracemalloc
+
+from array import array
+from collections import Counter
+from os import getenv
+
+# Общий слой замеров для всех скриптов: каждый замер сохраняется с точностью perf_counter_ns,
+# по замерам строятся перцентили и выгружаются сырые значения для Statistics.py
+warmup_iterations = int(getenv("WARMUP_ITERATIONS", "0"))
+samples_directory = getenv("SAMPLES_DIRECTORY", "samples")
+# bin - массив int64 наносекунд, parquet - столбец latency_ns (нужен pyarrow)
+samples_format = getenv("SAMPLES_FORMAT", "bin")
+percentiles = (50, 90, 99, 99.9)
+# Режим прогона по размерам набора данных: список количеств строк, 0 - весь набор.
+# Пустое значение - обычный прогон с размером из настроек скрипта
+sweep_sizes = [int(size) for size in getenv("SWEEP_SIZES", "").split(',') if size]
+sweep_iterations = int(getenv("SWEEP_ITERATIONS", "3"))
+# Профилирование замеряемых функций: '' - выключено, cprofile, tracemalloc или all.
+# При профилировании время операций завышено, эти прогоны нужны только для поиска накладных расходов клиента
+profile_mode = getenv("PROFILE_MODE", "")
+profiles_directory = getenv("PROFILES_DIRECTORY", "profiles")
+# Тихий режим: в замеряемых функциях не выводятся сообщения об успехе (ошибки выводятся всегда)
+quiet = getenv("QUIET", "0") == "1"
+
+# Накопленные профили по имени функции: cProfile.Profile и снимок tracemalloc самого затратного вызова
+_profiles = {}
+_allocation_peaks = {}
+# Число активных профилируемых вызовов: профилируется только внешний. Вложенный замер (например, пакетная вставка
+# внутри параллельной загрузки) уже входит в профиль внешнего, а в Python 3.12+ второй cProfile не включается
+_active_profiles = 0
+_active_profiles_lock = threading.Lock()
+
+
+def log(*args):
+    if not quiet:
+        print(*args)
+
+
+def call_with_profiling(func, *args, **kwargs):
+    global _active_profiles
+    with _active_profiles_lock:
+        outermost = _active_profiles == 0
+        _active_profiles += 1
+    try:
+        if not outermost:
+            return func(*args, **kwargs)
+        return profile_call(func, *args, **kwargs)
+    finally:
+        with _active_profiles_lock:
+            _active_profiles -= 1
+
+
+def profile_call(func, *args, **kwargs):
+    name = func.__name__
+    if profile_mode in ('tracemalloc', 'all'):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+    profiler = _profiles.setdefault(name, cProfile.Profile()) if profile_mode in ('cprofile', 'all') else None
+    if profiler:
+        profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if profiler:
+            profiler.disable()
+        if profile_mode in ('tracemalloc', 'all'):
+            peak = tracemalloc.get_traced_memory()[1]
+            if peak >= _allocation_peaks.get(name, (0, None))[0]:
+                _allocation_peaks[name] = (peak, tracemalloc.take_snapshot())
+
+
+def measure_execution_time(func):
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter_ns()
+        result = None
+        try:
+            if profile_mode:
+                result = call_with_profiling(func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+        except Exception as e:
+            print(f"Error executing {func.__name__}: {e}")
+        end_time = time.perf_counter_ns()
+        execution_time = (end_time - start_time) / 1e9
+        return result, execution_time
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+class LatencyHistogram:
+    # Гистограмма в духе HDR: значения группируются по степени двойки и внутри нее делятся
+    # на 2 ** sub_bucket_bits равных частей, поэтому относительная погрешность не больше 1 / 2 ** sub_bucket_bits
+    def __init__(self, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = Counter()
+        self.total_count = 0
+        self.max_value = 0
+
+    def record(self, value_ns):
+        value_ns = max(int(value_ns), 0)
+        shift = max(0, value_ns.bit_length() - 1 - self.sub_bucket_bits)
+        self.counts[(shift, value_ns >> shift)] += 1
+        self.total_count += 1
+        self.max_value = max(self.max_value, value_ns)
+
+    def value_at_percentile(self, percentile):
+        if not self.total_count:
+            return 0
+        target = max(1, math.ceil(percentile / 100 * self.total_count))
+        running = 0
+        for shift, sub_bucket in sorted(self.counts):
+            running += self.counts[(shift, sub_bucket)]
+            if running >= target:
+                # Верхняя граница корзины, как highest equivalent value в HdrHistogram
+                return min(((sub_bucket + 1) << shift) - 1, self.max_value)
+        return self.max_value
+
+
+def percentile_key(percentile):
+    return 'p' + f"{percentile:g}".replace('.', '_')
+
+
+def summarize(execution_times, iterations=None):
+    histogram = LatencyHistogram()
+    for execution_time in execution_times:
+        histogram.record(round(execution_time * 1e9))
+    summary = {
+        "iterations": iterations if iterations is not None else len(execution_times),
+        "total_execution_time": round(sum(execution_times), 5),
+        "mean_time": round(statistics.mean(execution_times), 5),
+        "variance_time": round(statistics.variance(execution_times), 5) if len(execution_times) > 1 else 0,
+    }
+    for percentile in percentiles:
+        summary[percentile_key(percentile)] = round(histogram.value_at_percentile(percentile) / 1e9, 6)
+    summary["max_time"] = round(histogram.max_value / 1e9, 6)
+    return summary
+
+
+def store_results(section, execution_times, suffix='', sample_name=None):
+    # Записывает сводку в секцию словаря результатов; suffix нужен для секций с двумя операциями (_2)
+    for name, value in summarize(execution_times).items():
+        section[f"{name}{suffix}"] = value
+    if sample_name:
+        export_samples(sample_name, execution_times)
+    return section
+
+
+def export_samples(name, execution_times, directory=None):
+    directory = directory or samples_directory
+    os.makedirs(directory, exist_ok=True)
+    samples_ns = [round(execution_time * 1e9) for execution_time in execution_times]
+    if samples_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        path = os.path.join(directory, f"{name}.parquet")
+        pq.write_table(pa.table({"latency_ns": pa.array(samples_ns, type=pa.int64())}), path)
+    else:
+        path = os.path.join(directory, f"{name}.bin")
+        with open(path, 'wb') as file:
+            array('q', samples_ns).tofile(file)
+    return path
+
+
+def load_samples(path):
+    # Возвращает замеры в секундах
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        samples_ns = pq.read_table(path).column('latency_ns').to_pylist()
+    else:
+        samples_ns = array('q')
+        with open(path, 'rb') as file:
+            samples_ns.frombytes(file.read())
+    return [sample / 1e9 for sample in samples_ns]
+
+
+def sweep_label(size):
+    return str(size) if size else 'full'
+
+
+def summarize_sweep_point(rows, execution_times_by_operation):
+    # Сводка одного размера: задержки и пропускная способность в строках набора в секунду
+    point = {"rows": rows, "operations": {}}
+    for operation, execution_times in execution_times_by_operation.items():
+        summary = summarize(execution_times)
+        point["operations"][operation] = {
+            "iterations": summary["iterations"],
+            "mean_time": summary["mean_time"],
+            "p99": summary["p99"],
+            "rows_per_second": round(rows / summary["mean_time"], 2) if summary["mean_time"] else 0,
+        }
+    return point
+
+
+def server_breakdown(execution_times, server_time_total):
+    # Делим клиентское время операции на время работы сервера и накладные расходы клиента
+    # (сеть, драйвер, разбор ответа в Python); server_time_total - суммарное время сервера за все итерации
+    client_mean = statistics.mean(execution_times) if execution_times else 0
+    server_mean = server_time_total / len(execution_times) if execution_times else 0
+    return {
+        "server_mean_time": round(server_mean, 6),
+        "client_overhead_mean_time": round(client_mean - server_mean, 6),
+        "server_time_share": round(server_mean / client_mean, 4) if client_mean else 0,
+    }
+
+
+def save_profiles(prefix, directory=None, top=30):
+    # Для каждой функции: <prefix>_<имя>.prof для snakeviz/pstats, текстовый топ по cumulative
+    # и топ строк по выделенной памяти в вызове с максимальным пиком
+    if not profile_mode:
+        return []
+    directory = directory or profiles_directory
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, profiler in _profiles.items():
+        path = os.path.join(directory, f"{prefix}_{name}")
+        profiler.dump_stats(path + '.prof')
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(top)
+        with open(path + '.txt', 'w') as file:
+            file.write(report.getvalue())
+        paths.append(path + '.prof')
+    for name, (peak, snapshot) in _allocation_peaks.items():
+        path = os.path.join(directory, f"{prefix}_{name}_allocations.txt")
+        with open(path, 'w') as file:
+            file.write(f"Peak traced memory: {peak} bytes\nAllocations alive at return:\n")
+            snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                               tracemalloc.Filter(False, __file__)))
+            for statistic in snapshot.statistics('lineno')[:top]:
+                file.write(f"{statistic}\n")
+        paths.append(path)
+    _profiles.clear()
+    _allocation_peaks.clear()
+    return paths
@@ -0,0 +1,115 @@
+import csv
+import io
+import json
+import math
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from Dataset_cache import parse_recipe_row
+
+# Конвейерный разбор CSV: основной поток делит файл на диапазоны байт по границам записей,
+# пул процессов превращает их в готовые к вставке пачки, а ограниченная очередь
+# отдает пачки писателю в базу, пока следующие диапазоны еще разбираются.
+# Размер диапазона выбирается так, чтобы на каждый процесс пришлось несколько диапазонов:
+# по limit строк, а без него - по размеру файла, в пределах от min_chunk_bytes до max_chunk_bytes
+ranges_per_worker = 4
+min_chunk_bytes = 1024 * 1024
+max_chunk_bytes = 16 * 1024 * 1024
+
+
+def read_fieldnames(file_path):
+    with open(file_path, 'rb') as file:
+        return next(csv.reader([file.readline().decode('utf-8')]))
+
+
+def iter_record_ranges(file_path, chunk_bytes=max_chunk_bytes, chunk_rows=None, limit=None):
+    # Поля с переводами строк заключены в кавычки, поэтому запись заканчивается на переводе строки,
+    # до которого с начала файла встретилось четное количество кавычек.
+    # Диапазон закрывается по chunk_bytes или chunk_rows записей; после limit записей файл дальше не читается
+    with open(file_path, 'rb') as file:
+        file.readline()
+        start = position = file.tell()
+        odd_quotes = 0
+        rows = scheduled = 0
+        for line in file:
+            position += len(line)
+            odd_quotes ^= line.count(b'"') & 1
+            if odd_quotes:
+                continue
+            rows += 1
+            if limit and scheduled + rows >= limit:
+                yield start, position
+                return
+            if position - start >= chunk_bytes or (chunk_rows and rows >= chunk_rows):
+                yield start, position
+                start = position
+                scheduled += rows
+                rows = 0
+        if position > start:
+            yield start, position
+
+
+def decode_range(file_path, fieldnames, start, end):
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        raw = file.read(end - start)
+    reader = csv.DictReader(io.StringIO(raw.decode('utf-8'), newline=''), fieldnames=fieldnames)
+    recipes = []
+    for row in reader:
+        try:
+            recipes.append(parse_recipe_row(row))
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON at offset {start}: {e}")
+    return recipes
+
+
+def iter_decoded_batches(file_path, limit=None, workers=None, chunk_bytes=None, queue_size=None):
+    workers = workers or os.cpu_count()
+    chunk_rows = math.ceil(limit / (workers * ranges_per_worker)) if limit else None
+    chunk_bytes = chunk_bytes or min(max_chunk_bytes, max(min_chunk_bytes,
+                                                          os.path.getsize(file_path) // (workers * ranges_per_worker)))
+    # Очередь ограничивает число разобранных, но еще не записанных пачек в памяти
+    pending = queue.Queue(maxsize=queue_size or workers * 2)
+    stop = threading.Event()
+    fieldnames = read_fieldnames(file_path)
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    def produce():
+        try:
+            for start, end in iter_record_ranges(file_path, chunk_bytes, chunk_rows, limit):
+                if stop.is_set():
+                    break
+                pending.put(executor.submit(decode_range, file_path, fieldnames, start, end))
+        finally:
+            pending.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    emitted = 0
+    try:
+        while True:
+            future = pending.get()
+            if future is None:
+                break
+            batch = future.result()
+            if limit:
+                batch = batch[:limit - emitted]
+            emitted += len(batch)
+            yield batch
+            if limit and emitted >= limit:
+                break
+    finally:
+        # Останавливаем читателя и освобождаем очередь, если писатель закончил раньше;
+        # еще не начатые диапазоны отменяются, чтобы их разбор не попал в замер
+        stop.set()
+        while producer.is_alive():
+            try:
+                future = pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,180 @@
+import pickle
+import time
+
+from collections import OrderedDict
+from os import getenv
+
+import redis
+
+import Measurement
+
+# Кэш результатов запросов перед обеими базами: LRU в памяти процесса с TTL и ограничением
+# по количеству записей и объему, плюс необязательный общий уровень в Redis.
+# Ключ записи включает версию таблицы, поэтому запись в таблицу инвалидирует все ее запросы
+# одним увеличением счетчика, а устаревшие записи вытесняются LRU или истекают по TTL
+query_cache_enabled = getenv("QUERY_CACHE", "0") == "1"
+query_cache_max_entries = int(getenv("QUERY_CACHE_MAX_ENTRIES", "128"))
+query_cache_max_bytes = int(getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+query_cache_ttl = float(getenv("QUERY_CACHE_TTL", "60"))
+# Общий уровень: результаты и версии таблиц хранятся в Redis и доступны всем процессам бенчмарка
+query_cache_shared = getenv("QUERY_CACHE_SHARED", "0") == "1"
+# Общий уровень живет в отдельной базе того же сервера, чтобы не смешиваться с ключами бенчмарка
+# (FLUSHDB, SCAN по рецептам, DBSIZE)
+query_cache_shared_db = int(getenv("QUERY_CACHE_SHARED_DB", "1"))
+# Как часто выполнять запись (инвалидацию) в бенчмарке кэша: раз в N итераций
+query_cache_invalidate_every = int(getenv("QUERY_CACHE_INVALIDATE_EVERY", "10"))
+
+
+def shared_client():
+    return redis.Redis(host=getenv("HOST_REDIS"), port=getenv("PORT_REDIS"), db=query_cache_shared_db)
+
+
+def shared_memory_usage():
+    # Объем общего уровня (ключи и память), чтобы исключить его из INFO memory тестируемого сервера
+    if not query_cache_shared:
+        return 0, 0
+    client = shared_client()
+    keys = list(client.scan_iter(match="query_cache:*", count=1000))
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.execute_command('MEMORY USAGE', key, 'SAMPLES', '0')
+    return len(keys), sum(usage for usage in pipe.execute() if usage)
+
+
+class QueryCache:
+    def __init__(self, namespace, max_entries=query_cache_max_entries, max_bytes=query_cache_max_bytes,
+                 ttl=query_cache_ttl, shared=query_cache_shared):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared_client = shared_client() if shared else None
+        # ключ -> (момент истечения, размер, значение)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.versions = {}
+        self.stats = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                      "invalidations": 0, "invalidation_time": 0.0}
+
+    def version_key(self, table):
+        return f"query_cache:{self.namespace}:version:{table}"
+
+    def version(self, table):
+        if self.shared_client:
+            return int(self.shared_client.get(self.version_key(table)) or 0)
+        return self.versions.get(table, 0)
+
+    def invalidate(self, table):
+        start_time = time.perf_counter_ns()
+        if self.shared_client:
+            self.shared_client.incr(self.version_key(table))
+        else:
+            self.versions[table] = self.versions.get(table, 0) + 1
+        self.stats["invalidations"] += 1
+        self.stats["invalidation_time"] += (time.perf_counter_ns() - start_time) / 1e9
+
+    def evict(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def store(self, key, value, size):
+        if key in self.entries:
+            self.evict(key)
+        self.entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            self.evict(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+    def get_or_compute(self, table, query_key, compute):
+        key = f"query_cache:{self.namespace}:{table}:{self.version(table)}:{query_key}"
+        entry = self.entries.get(key)
+        if entry:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[2]
+            self.evict(key)
+            self.stats["expirations"] += 1
+
+        if self.shared_client:
+            payload = self.shared_client.get(key)
+            if payload is not None:
+                self.stats["shared_hits"] += 1
+                # store может сразу вытеснить запись (max_entries=0 или значение больше max_bytes)
+                value = pickle.loads(payload)
+                self.store(key, value, len(payload))
+                return value
+
+        self.stats["misses"] += 1
+        value = compute()
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.shared_client:
+            self.shared_client.set(key, payload, px=int(self.ttl * 1000))
+        self.store(key, value, len(payload))
+        return value
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["shared_hits"] + self.stats["misses"]
+        summary = dict(self.stats)
+        summary["invalidation_time"] = round(summary["invalidation_time"], 6)
+        summary["hit_rate"] = round((self.stats["hits"] + self.stats["shared_hits"]) / lookups, 4) if lookups else 0
+        summary["entries"] = len(self.entries)
+        summary["bytes"] = self.total_bytes
+        return summary
+
+
+def create(namespace):
+    return QueryCache(namespace) if query_cache_enabled else None
+
+
+def cached(cache, table, query_key, compute):
+    # Без кэша запрос выполняется как обычно
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(table, query_key, compute)
+
+
+def invalidate(cache, table):
+    if cache is not None:
+        cache.invalidate(table)
+
+
+def perform_cache_operations(namespace, operations, use_cache, write, iterations,
+                             invalidate_every=query_cache_invalidate_every):
+    # Для каждой выборки: замер без кэша, затем с новым кэшем, в который каждые invalidate_every итераций
+    # приходит запись через write (тот же вызов инвалидации, что на путях записи скрипта).
+    # Время записи в замер не входит, стоимость инвалидации видна отдельно (invalidation_time)
+    # и по времени промахов после нее (miss_mean_time)
+    report = {}
+    for name, operation in operations.items():
+        use_cache(None)
+        uncached_times = [operation()[1] for _ in range(iterations)]
+
+        cache = QueryCache(namespace)
+        use_cache(cache)
+        # Первая инвалидация отсекает записи общего уровня, оставшиеся от прошлых запусков
+        write()
+        cached_times = []
+        miss_times = []
+        for iteration in range(iterations):
+            if iteration and invalidate_every and iteration % invalidate_every == 0:
+                write()
+            misses_before = cache.stats["misses"]
+            _, exec_time = operation()
+            cached_times.append(exec_time)
+            if cache.stats["misses"] > misses_before:
+                miss_times.append(exec_time)
+        use_cache(None)
+
+        uncached = Measurement.summarize(uncached_times)
+        section = {f"{key}_uncached": value for key, value in uncached.items()}
+        section.update({f"{key}_cached": value for key, value in Measurement.summarize(cached_times).items()})
+        section.update(cache.summary())
+        section["miss_mean_time"] = round(sum(miss_times) / len(miss_times), 5) if miss_times else 0
+        section["speedup"] = round(uncached["mean_time"] / section["mean_time_cached"], 2) \
+            if section["mean_time_cached"] else 0
+        section["invalidate_every"] = invalidate_every
+        section["shared"] = cache.shared_client is not None
+        report[name] = section
+    return report
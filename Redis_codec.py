@@ -0,0 +1,202 @@
+import json
+import time
+import zlib
+from os import getenv
+
+import msgpack
+import redis
+import zstd
+
+# Форматы хранения рецепта в Redis:
+# json - документ RedisJSON (единственный формат, с которым работают JSONPath в Lua-скриптах и RediSearch);
+# hash - хэш с отдельным значением на каждое поле рецепта, списки хранятся компактным JSON;
+# msgpack - весь рецепт одним блобом msgpack;
+# zlib, zstd - хэш, в котором большие списки ingredients и directions сжаты.
+# Все форматы читаются через клиент без декодирования ответов и декодируются здесь,
+# поэтому время декодирования для всех форматов считается одинаково
+list_fields = ('ingredients', 'directions', 'NER')
+compressed_fields = ('ingredients', 'directions')
+compression_level = int(getenv("REDIS_CODEC_COMPRESSION_LEVEL", "3"))
+
+# Процессорное время кодирования и декодирования (в секундах) и количество обработанных значений
+stats = {"encode_time": 0.0, "decode_time": 0.0, "encoded": 0, "decoded": 0}
+
+# Основной клиент -> клиент к тому же узлу без decode_responses
+_raw_clients = {}
+
+
+def reset_stats():
+    stats.update(encode_time=0.0, decode_time=0.0, encoded=0, decoded=0)
+
+
+def timed(operation, func, *args):
+    # thread_time учитывает только процессорное время текущего потока, ожидание сети в него не входит
+    start_time = time.thread_time_ns()
+    result = func(*args)
+    stats[f"{operation}_time"] += (time.thread_time_ns() - start_time) / 1e9
+    stats[f"{operation}d"] += 1
+    return result
+
+
+def serialize(value):
+    # Компактная сериализация без отступов и пробелов
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def raw_client(client):
+    # У основных клиентов включен decode_responses, а msgpack и сжатые поля - двоичные данные,
+    # которые нельзя декодировать как UTF-8
+    raw = _raw_clients.get(client)
+    if raw is None:
+        pool = client.connection_pool
+        connection_kwargs = dict(pool.connection_kwargs, decode_responses=False)
+        raw = redis.Redis(connection_pool=redis.ConnectionPool(connection_class=pool.connection_class,
+                                                               **connection_kwargs))
+        _raw_clients[client] = raw
+    return raw
+
+
+def path_field(path):
+    # Форматы кроме RedisJSON понимают только весь документ '$' и поле верхнего уровня '$.field'
+    return None if path in ('$', '.') else path[2:]
+
+
+class RecipeCodec:
+    name = None
+    # Поддерживает ли формат серверные операции над документом (JSONPath в Lua-скриптах, RediSearch)
+    server_side = False
+
+    def write(self, pipe, key, recipe):
+        raise NotImplementedError
+
+    def write_many(self, pipe, items, mset=False):
+        for key, recipe in items:
+            self.write(pipe, key, recipe)
+
+    def read(self, client, keys, path='$'):
+        # Возвращает пары (ключ, значение) для существующих ключей
+        raise NotImplementedError
+
+    def set_fields(self, client, pipe, items, path):
+        # items - пары (ключ, новое значение поля path)
+        raise NotImplementedError
+
+
+class JSONCodec(RecipeCodec):
+    name = 'json'
+    server_side = True
+
+    def write(self, pipe, key, recipe):
+        pipe.execute_command('JSON.SET', key, '.', timed('encode', serialize, recipe))
+
+    def write_many(self, pipe, items, mset=False):
+        if not mset:
+            return super().write_many(pipe, items)
+        arguments = []
+        for key, recipe in items:
+            arguments.extend((key, '$', timed('encode', serialize, recipe)))
+        pipe.execute_command('JSON.MSET', *arguments)
+
+    def read(self, client, keys, path='$'):
+        values = raw_client(client).execute_command('JSON.MGET', *keys, path)
+        decoded = [(key, timed('decode', json.loads, value)) for key, value in zip(keys, values) if value]
+        # JSONPath возвращает список совпадений, берем первое
+        return [(key, value[0]) for key, value in decoded if value]
+
+    def set_fields(self, client, pipe, items, path):
+        for key, value in items:
+            pipe.execute_command('JSON.SET', key, path, timed('encode', serialize, value))
+
+
+class HashCodec(RecipeCodec):
+    name = 'hash'
+
+    def __init__(self, name='hash', compress=None, decompress=None):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+    def encode_field(self, field, value):
+        if field not in list_fields:
+            return value
+        encoded = serialize(value).encode()
+        if self.compress and field in compressed_fields:
+            encoded = self.compress(encoded)
+        return encoded
+
+    def decode_field(self, field, value):
+        if field not in list_fields:
+            return value.decode()
+        if self.decompress and field in compressed_fields:
+            value = self.decompress(value)
+        return json.loads(value)
+
+    def encode(self, recipe):
+        return {field: self.encode_field(field, value) for field, value in recipe.items()}
+
+    def decode(self, value, field=None):
+        if field is not None:
+            return self.decode_field(field, value)
+        return {name.decode(): self.decode_field(name.decode(), item) for name, item in value.items()}
+
+    def write(self, pipe, key, recipe):
+        pipe.hset(key, mapping=timed('encode', self.encode, recipe))
+
+    def read(self, client, keys, path='$'):
+        field = path_field(path)
+        pipe = raw_client(client).pipeline(transaction=False)
+        for key in keys:
+            if field is None:
+                pipe.hgetall(key)
+            else:
+                pipe.hget(key, field)
+        # HGET отсутствующего поля дает None, а пустая строка b'' - настоящее значение;
+        # HGETALL отсутствующего ключа дает пустой словарь
+        return [(key, timed('decode', self.decode, value, field))
+                for key, value in zip(keys, pipe.execute()) if (value if field is None else value is not None)]
+
+    def set_fields(self, client, pipe, items, path):
+        field = path_field(path)
+        for key, value in items:
+            pipe.hset(key, field, timed('encode', self.encode_field, field, value))
+
+
+class MsgpackCodec(RecipeCodec):
+    name = 'msgpack'
+
+    def write(self, pipe, key, recipe):
+        pipe.set(key, timed('encode', msgpack.packb, recipe))
+
+    def read(self, client, keys, path='$'):
+        field = path_field(path)
+        values = raw_client(client).mget(keys)
+        # Даже для одного поля блоб читается и декодируется целиком
+        recipes = [(key, timed('decode', msgpack.unpackb, value)) for key, value in zip(keys, values) if value]
+        if field is None:
+            return recipes
+        return [(key, recipe[field]) for key, recipe in recipes if field in recipe]
+
+    def set_fields(self, client, pipe, items, path):
+        # Блоб не меняется по частям: документы пачки дочитываются одним MGET и перезаписываются целиком
+        field = path_field(path)
+        recipes = dict(self.read(client, [key for key, _ in items]))
+        for key, value in items:
+            if key in recipes:
+                recipes[key][field] = value
+                self.write(pipe, key, recipes[key])
+
+
+codecs = {
+    'json': JSONCodec(),
+    'hash': HashCodec(),
+    'msgpack': MsgpackCodec(),
+    'zlib': HashCodec('zlib', lambda data: zlib.compress(data, compression_level), zlib.decompress),
+    'zstd': HashCodec('zstd', lambda data: zstd.compress(data, compression_level), zstd.decompress),
+}
+
+
+def create(name):
+    if name not in codecs:
+        print(f"Unknown Redis codec '{name}', falling back to json")
+        name = 'json'
+    return codecs[name]
@@ -1,18 +1,63 @@
 import csv
-import statistics
+import sys
 import time
 import pandas as pd
 import json
+import Dataset_cache
+import Measurement
+import Parallel_ingest
+import Query_cache
+import Redis_codec
+import re
+import bisect
+import hashlib
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 from rejson import Client, Path
+import os
 from os import getenv
 from dotenv import load_dotenv, find_dotenv
+from Measurement import measure_execution_time
 
 load_dotenv(find_dotenv())
 host = getenv("HOST_REDIS")
 port = getenv("PORT_REDIS")
 user = getenv("USER_REDIS")
 database = getenv("DATABASE_REDIS")
+# Размеры пачек для массовой вставки и способ отправки: pipeline или mset (JSON.MSET, только для формата json)
+insert_batch_sizes = [int(size) for size in getenv("REDIS_BATCH_SIZES", "100,500,1000,5000").split(',')]
+insert_mode = getenv("REDIS_INSERT_MODE", "pipeline")
+# Сколько ключей запрашивать за один шаг SCAN и одно пакетное чтение
+scan_chunk_size = int(getenv("REDIS_SCAN_CHUNK_SIZE", "1000"))
+# Отсортированное множество частот NER, которое поддерживается при записи
+ner_index_key = 'recipe_index:ner'
+ner_index_enabled = getenv("REDIS_NER_INDEX", "0") == "1"
+# Вторичный индекс по названию: '' - нет, 'set' - множество ключей на каждое название,
+# 'search' - индекс RediSearch по $.title (если модуль не загружен, используется 'set')
+title_index_mode = getenv("REDIS_TITLE_INDEX", "")
+title_search_index = 'recipe_title_idx'
+# Триграммный индекс по названию: множество ключей на каждую тройку символов названия в нижнем регистре.
+# Поиск подстроки пересекает множества ее триграмм (SINTER) и проверяет названия только у кандидатов
+trigram_index_enabled = getenv("REDIS_TRIGRAM_INDEX", "0") == "1"
+# Читать рецепты из колоночного кэша Arrow вместо повторного разбора CSV
+use_dataset_cache = getenv("USE_DATASET_CACHE", "1") == "1"
+# Источник рецептов: читается потоково при каждой вставке, весь набор в памяти не держится
+dataset_path = getenv("REDIS_DATASET_PATH", 'dataset/full_dataset.csv')
+dataset_limit = int(getenv("REDIS_LIMIT", "10000")) or None
+# Количество процессов для конвейерного разбора CSV при вставке
+ingest_worker_counts = sorted({1, os.cpu_count() or 1})
+# Сколько ключей каждого вида опрашивать командой MEMORY USAGE при оценке объема
+memory_sample_size = int(getenv("REDIS_MEMORY_SAMPLE_SIZE", "1000"))
+# Шардированный режим: узлы host:port через запятую (для проверки достаточно нескольких локальных redis-server).
+# Ключи распределяются по узлам консистентным хэшированием, замеры идут для 1, 2, ... N первых узлов
+shard_endpoints = [endpoint for endpoint in getenv("REDIS_SHARDS", "").split(',') if endpoint]
+shard_virtual_nodes = int(getenv("REDIS_SHARD_VIRTUAL_NODES", "160"))
+# Формат хранения рецептов (см. Redis_codec): json, hash, msgpack, zlib или zstd,
+# и список форматов для сравнения между собой
+redis_codec = getenv("REDIS_CODEC", "json")
+compared_codecs = getenv("REDIS_CODECS", "json,hash,msgpack,zlib,zstd").split(',')
 
 
 results_redis = {
@@ -47,6 +92,64 @@ results_redis = {
 }
 
 redis_client = Client(host=host, port=port, decode_responses=True)
+# Кэш результатов выборок; инвалидируется на всех путях записи рецептов
+query_cache = Query_cache.create('redis')
+# Все чтения и записи рецептов идут через кодек выбранного формата
+codec = Redis_codec.create(redis_codec)
+
+# Серверные версии удаления и обновления: скрипт сам делает один шаг SCAN, проверяет документы
+# и изменяет их на месте, клиенту возвращаются только затронутые ключи.
+# Ключи не передаются через KEYS, поэтому скрипты рассчитаны на одиночный Redis, а не на кластер.
+# ARGV: курсор, шаблон ключей, COUNT, 1 - вернуть старые значения для обновления индексов на клиенте
+DELETE_PIE_SCRIPT = """
+local result = redis.call('SCAN', ARGV[1], 'MATCH', ARGV[2], 'COUNT', ARGV[3])
+local deleted = {}
+for _, key in ipairs(result[2]) do
+    local raw_title = redis.call('JSON.GET', key, '$.title')
+    local title = raw_title and cjson.decode(raw_title)[1]
+    if type(title) == 'string' and string.find(string.lower(title), 'pie', 1, true) then
+        table.insert(deleted, key)
+        if ARGV[4] == '1' then
+            table.insert(deleted, redis.call('JSON.GET', key, '$'))
+        end
+        redis.call('DEL', key)
+    end
+end
+return {result[1], deleted}
+"""
+
+UPDATE_WATER_SCRIPT = """
+local result = redis.call('SCAN', ARGV[1], 'MATCH', ARGV[2], 'COUNT', ARGV[3])
+local updated = {}
+for _, key in ipairs(result[2]) do
+    local raw_ner = redis.call('JSON.GET', key, '$.NER')
+    local ner_list = raw_ner and cjson.decode(raw_ner)[1]
+    local has_water = false
+    if type(ner_list) == 'table' then
+        for _, ner in ipairs(ner_list) do
+            if ner == 'water' then
+                has_water = true
+                break
+            end
+        end
+    end
+    if has_water then
+        local updated_ner = {}
+        for i, ner in ipairs(ner_list) do
+            updated_ner[i] = (string.gsub(ner, 'water', 'TEST'))
+        end
+        redis.call('JSON.SET', key, '$.NER', cjson.encode(updated_ner))
+        table.insert(updated, key)
+        if ARGV[4] == '1' then
+            table.insert(updated, raw_ner)
+        end
+    end
+end
+return {result[1], updated}
+"""
+
+delete_pie_script = redis_client.register_script(DELETE_PIE_SCRIPT)
+update_water_script = redis_client.register_script(UPDATE_WATER_SCRIPT)
 
 
 def write_results_to_excel(results, filename='results_redis.xlsx'):
@@ -61,24 +164,12 @@ def write_results_to_excel(results, filename='results_redis.xlsx'):
         print(f"Error saving results to Excel: {e}")
 
 
-def measure_execution_time(func):
-    def wrapper(*args, **kwargs):
-        start_time = time.monotonic()
-        result = None
-        try:
-            result = func(*args, **kwargs)
-        except Exception as e:
-            print(f"Error executing {func.__name__}: {e}")
-        end_time = time.monotonic()
-        execution_time = end_time - start_time
-        return result, execution_time
-    return wrapper
-
-
-def load_data_from_csv(file_path, limit=None):
+def iter_data_from_csv(file_path, limit=None):
+    if use_dataset_cache or Dataset_cache.is_arrow(file_path):
+        yield from Dataset_cache.iter_recipes(file_path, limit)
+        return
     with open(file_path, mode='r', encoding='utf-8') as file:
         csv_reader = csv.DictReader(file)
-        data = []
         for idx, row in enumerate(csv_reader):
             if limit and idx >= limit:
                 break
@@ -86,193 +177,996 @@ def load_data_from_csv(file_path, limit=None):
                 row['ingredients'] = json.loads(row['ingredients'])
                 row['directions'] = json.loads(row['directions'])
                 row['NER'] = json.loads(row['NER'])
-                data.append(row)
+                yield row
             except json.JSONDecodeError as e:
                 print(f"Error decoding JSON for row {idx}: {e}")
                 continue
-        return data
+
+
+def recipe_source():
+    # Каждый вызов возвращает новый генератор, поэтому данные можно вставлять повторно
+    return iter_data_from_csv(dataset_path, dataset_limit)
+
+
+class TimedSource:
+    # Итератор по рецептам, который считает время их чтения и разбора. При потоковой загрузке
+    # разбор идет внутри замеренной вставки, это время из замера вычитается и сообщается отдельно
+    def __init__(self, recipes):
+        self.recipes = iter(recipes)
+        self.decode_time = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start_time = time.perf_counter_ns()
+        try:
+            return next(self.recipes)
+        finally:
+            self.decode_time += (time.perf_counter_ns() - start_time) / 1e9
+
+
+def insert_from_source(insert, source, *args):
+    # Возвращает (строки, время вставки без разбора, время разбора)
+    recipes = TimedSource(source())
+    inserted, exec_time = insert(recipes, *args)
+    return inserted, exec_time - recipes.decode_time, recipes.decode_time
+
+
+def peak_rss_megabytes():
+    # ru_maxrss - пиковый RSS процесса: в килобайтах на Linux и в байтах на macOS
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak_rss / (1024 ** 2 if sys.platform == 'darwin' else 1024), 2)
 
 
 @measure_execution_time
 def insert_data_to_redis(data):
+    inserted = 0
     for idx, recipe in enumerate(data):
         key = f"recipe:{idx}"
-        formatted_recipe = json.dumps(recipe, indent=2, ensure_ascii=False)
-        redis_client.execute_command('JSON.SET', key, '.', formatted_recipe)
-        print(f"Inserted {key}")
+        codec.write(redis_client, key, recipe)
+        update_recipe_indexes(redis_client, added=[(key, recipe)])
+        Measurement.log(f"Inserted {key}")
+        inserted += 1
+    Query_cache.invalidate(query_cache, 'recipes')
+    return inserted
+
+
+def serialize_recipe(recipe):
+    return Redis_codec.serialize(recipe)
+
+
+def title_index_key(title):
+    return f'recipe_index:title:{title}'
+
+
+def escape_tag_value(value):
+    # В запросах RediSearch по TAG-полю пробелы и знаки препинания нужно экранировать
+    return re.sub(r'([^\w])', r'\\\1', value)
+
+
+def create_title_index():
+    global title_index_mode
+    if title_index_mode != 'search':
+        return
+    if not codec.server_side:
+        print(f"RediSearch index needs RedisJSON documents, falling back to title index on sets for '{codec.name}'")
+        title_index_mode = 'set'
+        return
+    try:
+        modules = redis_client.execute_command('MODULE LIST')
+    except Exception as e:
+        # Серверы без команды MODULE (совместимые реализации, запреты в managed-инсталляциях) модулей не грузят
+        print(f"Error listing Redis modules: {e}")
+        modules = []
+    if not any('search' in str(module).lower() for module in modules):
+        print("RediSearch module is not available, falling back to title index on sets")
+        title_index_mode = 'set'
+        return
+    try:
+        redis_client.execute_command('FT.CREATE', title_search_index, 'ON', 'JSON', 'PREFIX', '1', 'recipe:',
+                                     'SCHEMA', '$.title', 'AS', 'title', 'TAG', 'SEPARATOR', '|', 'CASESENSITIVE')
+        print(f"Index '{title_search_index}' created.")
+    except Exception as e:
+        print(f"Error creating index '{title_search_index}': {e}")
+
+
+def title_trigrams(text):
+    text = text.lower()
+    return {text[position:position + 3] for position in range(len(text) - 2)}
+
+
+def trigram_index_key(trigram):
+    return f'recipe_index:trigram:{trigram}'
+
+
+def indexes_enabled():
+    return ner_index_enabled or title_index_mode == 'set' or trigram_index_enabled
+
+
+def update_recipe_indexes(pipe, added=(), removed=()):
+    # added и removed - списки пар (ключ, рецепт), которые появились или исчезли из базы
+    if ner_index_enabled:
+        ner_delta = Counter()
+        for _, recipe in added:
+            ner_delta.update(recipe.get('NER', []))
+        for _, recipe in removed:
+            ner_delta.subtract(recipe.get('NER', []))
+        for ner_entity, delta in ner_delta.items():
+            if delta:
+                pipe.zincrby(ner_index_key, delta, ner_entity)
+        if removed:
+            pipe.zremrangebyscore(ner_index_key, '-inf', 0)
+    # Индекс RediSearch обновляется сервером сам, вручную ведем только индекс на множествах
+    if title_index_mode == 'set':
+        for key, recipe in added:
+            if 'title' in recipe:
+                pipe.sadd(title_index_key(recipe['title']), key)
+        for key, recipe in removed:
+            if 'title' in recipe:
+                pipe.srem(title_index_key(recipe['title']), key)
+    # Название при обновлении NER не меняется, поэтому триграммы затрагивают только вставка и удаление.
+    # Ключи пачки группируются по триграмме: одна команда SADD/SREM на триграмму, а не на рецепт
+    if trigram_index_enabled:
+        for recipes, command in ((added, pipe.sadd), (removed, pipe.srem)):
+            keys_by_trigram = {}
+            for key, recipe in recipes:
+                for trigram in title_trigrams(recipe.get('title', '')):
+                    keys_by_trigram.setdefault(trigram, []).append(key)
+            for trigram, keys in keys_by_trigram.items():
+                command(trigram_index_key(trigram), *keys)
+
+
+def iter_batches(items, batch_size):
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+@measure_execution_time
+def insert_data_to_redis_batched(data, batch_size=1000, mode=insert_mode):
+    # data может быть генератором: в памяти одновременно находится только одна пачка
+    inserted = 0
+    for batch in iter_batches(((f"recipe:{idx}", recipe) for idx, recipe in enumerate(data)), batch_size):
+        write_recipe_batch(batch, mode)
+        inserted += len(batch)
+    Query_cache.invalidate(query_cache, 'recipes')
+    return inserted
+
+
+# Пакетные операции записи с поддержкой индексов; кэш выборок инвалидирует вызывающий код
+def write_recipe_batch(batch, mode=insert_mode):
+    pipe = redis_client.pipeline(transaction=False)
+    codec.write_many(pipe, batch, mset=(mode == 'mset'))
+    update_recipe_indexes(pipe, added=batch)
+    pipe.execute()
+
+
+def delete_recipe_batch(keys):
+    pipe = redis_client.pipeline(transaction=False)
+    if indexes_enabled():
+        update_recipe_indexes(pipe, removed=fetch_recipes(keys))
+    pipe.delete(*keys)
+    pipe.execute()
 
 
-def clear_redis_data(pattern="recipe:*"):
-    keys = redis_client.keys(pattern)
-    if keys:
-        redis_client.delete(*keys)
-        print(f"Deleted {len(keys)} keys")
+def update_ner_batch(batch, old, new):
+    # batch - пары (ключ, NER), в каждом элементе NER подстрока old заменяется на new
+    pipe = redis_client.pipeline(transaction=False)
+    updated_batch = [(key, [ner.replace(old, new) for ner in ner_list]) for key, ner_list in batch]
+    codec.set_fields(redis_client, pipe, updated_batch, '$.NER')
+    update_recipe_indexes(pipe,
+                          added=[(key, {'NER': ner_list}) for key, ner_list in updated_batch],
+                          removed=[(key, {'NER': ner_list}) for key, ner_list in batch])
+    pipe.execute()
 
 
-def perform_insert_table_operations(iterations: int, data: list) -> list[float]:
+def clear_redis_data(pattern="recipe:*", client=None):
+    client = client or redis_client
+    deleted = 0
+    # Вместе с рецептами удаляем и построенные по ним индексы
+    for current_pattern in (pattern, 'recipe_index:*'):
+        for keys in iter_batches(client.scan_iter(match=current_pattern, count=scan_chunk_size), scan_chunk_size):
+            deleted += client.delete(*keys)
+    Query_cache.invalidate(query_cache, 'recipes')
+    if deleted:
+        print(f"Deleted {deleted} keys")
+
+
+def restore_redis_data():
+    clear_redis_data()
+    insert_data_to_redis_batched(recipe_source())
+
+
+def fetch_recipes(keys, path='$', client=None):
+    return codec.read(client or redis_client, keys, path)
+
+
+def scan_recipes(path='$', pattern='recipe:*', chunk_size=scan_chunk_size, client=None):
+    # Обходим ключи курсором SCAN и забираем документы пачками одним запросом на пачку.
+    # path позволяет забрать только нужную часть документа, например '$.NER' или '$.title'
+    client = client or redis_client
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor=cursor, match=pattern, count=chunk_size)
+        if keys:
+            yield from fetch_recipes(keys, path, client)
+        if cursor == 0:
+            break
+
+
+def sample_memory_usage(pattern, sample_size=memory_sample_size):
+    # Считаем все ключи шаблона, а MEMORY USAGE запрашиваем только у первых sample_size из них
+    key_count = 0
+    sampled_keys = []
+    for key in redis_client.scan_iter(match=pattern, count=scan_chunk_size):
+        key_count += 1
+        if len(sampled_keys) < sample_size:
+            sampled_keys.append(key)
+    if not sampled_keys:
+        return key_count, 0
+    pipe = redis_client.pipeline(transaction=False)
+    for key in sampled_keys:
+        # SAMPLES 0 - учитывать все элементы вложенных структур, а не выборку из них
+        pipe.execute_command('MEMORY USAGE', key, 'SAMPLES', '0')
+    usages = [usage for usage in pipe.execute() if usage]
+    return key_count, (sum(usages) / len(usages) if usages else 0)
+
+
+def collect_storage_footprint():
+    footprint = {}
+    try:
+        memory_info = redis_client.info('memory')
+        recipes, recipe_bytes = sample_memory_usage('recipe:*')
+        index_keys, index_bytes = sample_memory_usage('recipe_index:*')
+        cache_keys, cache_bytes = Query_cache.shared_memory_usage()
+    except Exception as e:
+        print(f"Error collecting storage footprint: {e}")
+        return footprint
+    for field in ('used_memory', 'used_memory_dataset', 'used_memory_overhead', 'mem_fragmentation_ratio'):
+        footprint[field] = memory_info.get(field, 0)
+    footprint["recipes"] = recipes
+    footprint["sampled_bytes_per_recipe"] = round(recipe_bytes, 2)
+    footprint["index_keys"] = index_keys
+    footprint["estimated_index_bytes"] = round(index_keys * index_bytes)
+    # Оценка по выборке ключей и по INFO memory (включает индексы и служебные структуры)
+    footprint["bytes_per_recipe"] = round((recipes * recipe_bytes + footprint["estimated_index_bytes"]) / recipes, 2) \
+        if recipes else 0
+    # INFO memory считается по всему серверу, поэтому общий уровень кэша выборок из него вычитается
+    footprint["query_cache_keys"] = cache_keys
+    footprint["query_cache_bytes"] = cache_bytes
+    footprint["dataset_bytes_per_recipe"] = round(
+        (footprint["used_memory_dataset"] - cache_bytes) / recipes, 2) if recipes else 0
+    return footprint
+
+
+# Серверная сторона операций: разница INFO commandstats и новые записи SLOWLOG вокруг каждой замеренной итерации
+server_stats = {}
+
+
+def commandstats_snapshot():
+    return {name[len('cmdstat_'):]: (stats['calls'], stats['usec'])
+            for name, stats in redis_client.info('commandstats').items()}
+
+
+def begin_server_stats():
+    entries = redis_client.slowlog_get(1)
+    return commandstats_snapshot(), entries[0]['id'] if entries else -1
+
+
+def end_server_stats(operation, snapshot):
+    before, last_slowlog_id = snapshot
+    after = commandstats_snapshot()
+    stats = server_stats.setdefault(operation, {"calls": Counter(), "usec": Counter(), "slowlog": []})
+    for command, (calls, usec) in after.items():
+        previous_calls, previous_usec = before.get(command, (0, 0))
+        # Команды самого замера (INFO, SLOWLOG) в учет не идут
+        if command in ('info', 'slowlog') or calls <= previous_calls:
+            continue
+        stats["calls"][command] += calls - previous_calls
+        stats["usec"][command] += usec - previous_usec
+    stats["slowlog"] += [entry['duration'] for entry in redis_client.slowlog_get(128) if entry['id'] > last_slowlog_id]
+
+
+def server_stats_summary(operation, execution_times):
+    stats = server_stats.pop(operation, None)
+    if not stats:
+        return {}
+    summary = Measurement.server_breakdown(execution_times, sum(stats["usec"].values()) / 1e6)
+    summary["server_calls_per_operation"] = round(sum(stats["calls"].values()) / len(execution_times), 2)
+    summary["server_top_commands"] = ', '.join(
+        f"{command}:{round(usec / len(execution_times))}us" for command, usec in stats["usec"].most_common(3))
+    summary["slowlog_entries"] = len(stats["slowlog"])
+    summary["slowlog_max_usec"] = max(stats["slowlog"], default=0)
+    return summary
+
+
+def perform_insert_table_operations(iterations: int, source) -> list[float]:
     execution_times = []
-    for _ in range(iterations):
+    decode_times = []
+    for iteration in range(Measurement.warmup_iterations + iterations):
         clear_redis_data()
-        _, exec_time = insert_data_to_redis(data)
-        execution_times.append(exec_time)
-
-    mean_insert_time = round(statistics.mean(execution_times), 5)
-    variance_insert_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
+        snapshot = begin_server_stats()
+        _, exec_time, decode_time = insert_from_source(insert_data_to_redis, source)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+            decode_times.append(decode_time)
+            end_server_stats('insert_redis', snapshot)
 
-    results_redis["insert_redis"]["iterations"] = iterations
-    results_redis["insert_redis"]["mean_time"] = mean_insert_time
-    results_redis["insert_redis"]["variance_time"] = variance_insert_time
-    results_redis["insert_redis"]["total_execution_time"] = total_execution_time
+    Measurement.store_results(results_redis["insert_redis"], execution_times, sample_name="insert_redis")
+    results_redis["insert_redis"].update(server_stats_summary('insert_redis', execution_times))
+    results_redis["insert_redis"]["decode_mean_time"] = Measurement.summarize(decode_times)["mean_time"]
+    results_redis["insert_redis"]["peak_rss_mb"] = peak_rss_megabytes()
 
     return execution_times
 
 
 @measure_execution_time
-def select_most_common_ner():
+def insert_data_to_redis_parallel_ingest(file_path, limit=None, workers=None, batch_size=1000):
+    # Разбор CSV в пуле процессов идет параллельно с записью пачек в Redis
+    batches = Parallel_ingest.iter_decoded_batches(file_path, limit, workers)
+    inserted, _ = insert_data_to_redis_batched(chain.from_iterable(batches), batch_size)
+    return inserted
+
+
+def perform_insert_parallel_ingest_operations(iterations: int, file_path: str, limit: int) -> dict:
+    ingest_execution_times = {}
+    if Dataset_cache.is_arrow(file_path):
+        print(f"Skipping parallel ingest: {file_path} is not a CSV file")
+        return ingest_execution_times
+    for workers in ingest_worker_counts:
+        execution_times = []
+        for _ in range(iterations):
+            clear_redis_data()
+            inserted, exec_time = insert_data_to_redis_parallel_ingest(file_path, limit, workers)
+            execution_times.append(exec_time)
+
+        section = Measurement.summarize(execution_times)
+        # Если вставка завершилась ошибкой, inserted равен None
+        section["rows_per_second"] = round(inserted / section["mean_time"], 2) \
+            if inserted and section["mean_time"] else 0
+        section["peak_rss_mb"] = peak_rss_megabytes()
+        results_redis[f"ingest_redis_workers_{workers}"] = section
+        Measurement.export_samples(f"ingest_redis_workers_{workers}", execution_times)
+        ingest_execution_times[workers] = execution_times
+
+    return ingest_execution_times
+
+
+def perform_insert_batched_operations(iterations: int, source, batch_sizes: list[int]) -> dict:
+    batched_execution_times = {}
+    for batch_size in batch_sizes:
+        execution_times = []
+        decode_times = []
+        for _ in range(iterations):
+            clear_redis_data()
+            inserted, exec_time, decode_time = insert_from_source(insert_data_to_redis_batched, source, batch_size)
+            execution_times.append(exec_time)
+            decode_times.append(decode_time)
+
+        section = Measurement.summarize(execution_times)
+        section["decode_mean_time"] = Measurement.summarize(decode_times)["mean_time"]
+        section["mode"] = insert_mode
+        # Если вставка завершилась ошибкой, inserted равен None
+        section["rows_per_second"] = round(inserted / section["mean_time"], 2) \
+            if inserted and section["mean_time"] else 0
+        section["peak_rss_mb"] = peak_rss_megabytes()
+        results_redis[f"insert_redis_batch_{batch_size}"] = section
+        Measurement.export_samples(f"insert_redis_batch_{batch_size}", execution_times)
+        batched_execution_times[batch_size] = execution_times
+
+    return batched_execution_times
+
+
+def count_most_common_ner():
     # Создаем словарь для хранения частоты именованных сущностей
     ner_counts = {}
 
-    # Получаем список всех ключей, соответствующих шаблону 'recipe:*'
-    keys = redis_client.keys('recipe:*')
-
-    # Проходим по каждому ключу
-    for key in keys:
-        # Получаем JSON из Redis по текущему ключу
-        recipe_data = redis_client.execute_command('JSON.GET', key)
-
-        # Проверяем, что полученные данные не пустые
-        if recipe_data:
-            # Получаем список NER из объекта recipe_data
-            ner_list = recipe_data.get('NER', [])
-
-            # Обновляем частоту каждого элемента NER
-            for ner_entity in ner_list:
-                if ner_entity in ner_counts:
-                    ner_counts[ner_entity] += 1
-                else:
-                    ner_counts[ner_entity] = 1
-
-    # Сортируем по частоте и выводим топ-50
-    sorted_ner_counts = sorted(ner_counts.items(), key=lambda x: x[1])[-50:]
-    # return sorted_ner_counts
+    # Проходим по всем рецептам, забирая из Redis только поле NER
+    for _, ner_list in scan_recipes('$.NER'):
+        # Обновляем частоту каждого элемента NER
+        for ner_entity in ner_list:
+            if ner_entity in ner_counts:
+                ner_counts[ner_entity] += 1
+            else:
+                ner_counts[ner_entity] = 1
+
+    # Сортируем по частоте и оставляем топ-50
+    return sorted(ner_counts.items(), key=lambda x: x[1])[-50:]
+
+
+@measure_execution_time
+def select_most_common_ner():
+    sorted_ner_counts = Query_cache.cached(query_cache, 'recipes', 'select_most_common_ner', count_most_common_ner)
     for ner_entity, count in enumerate(sorted_ner_counts, start=1):
-        print(f"{ner_entity}: {count}")
+        Measurement.log(f"{ner_entity}: {count}")
+    return sorted_ner_counts
+
+
+@measure_execution_time
+def select_most_common_ner_indexed():
+    # Топ-50 берем напрямую из отсортированного множества, которое ведется при записи
+    top_ner = redis_client.zrevrange(ner_index_key, 0, 49, withscores=True)
+    for position, (ner_entity, count) in enumerate(top_ner, start=1):
+        Measurement.log(f"{position}: {ner_entity} {int(count)}")
+    return top_ner
 
 
 def perform_select_table_operations_most_common(iterations: int) -> list[float]:
     execution_times = []
-    for _ in range(iterations):
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        snapshot = begin_server_stats()
         _, exec_time = select_most_common_ner()
-        execution_times.append(exec_time)
-
-    mean_insert_time = round(statistics.mean(execution_times), 5)
-    variance_insert_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+            end_server_stats('select_redis_2', snapshot)
 
-    results_redis["select_redis"]["iterations_2"] = iterations
-    results_redis["select_redis"]["mean_time_2"] = mean_insert_time
-    results_redis["select_redis"]["variance_time_2"] = variance_insert_time
-    results_redis["select_redis"]["total_execution_time_2"] = total_execution_time
+    Measurement.store_results(results_redis["select_redis"], execution_times, '_2', sample_name="select_redis_2")
+    for name, value in server_stats_summary('select_redis_2', execution_times).items():
+        results_redis["select_redis"][f"{name}_2"] = value
 
     return execution_times
 
 
+def find_chicken_parmesan_directions():
+    found = []
+    for key, title in scan_recipes('$.title'):
+        if title == 'Baked Chicken Parmesan':
+            found.extend(directions for _, directions in fetch_recipes([key], '$.directions'))
+    return found
+
+
 @measure_execution_time
 def select_recipe_chicken_parmesan():
-    keys = redis_client.keys('recipe:*')
-    for key in keys:
-        recipe_data = redis_client.execute_command('JSON.GET', key)
-        if recipe_data.get('title') == 'Baked Chicken Parmesan':
-            directions = recipe_data.get('directions')
-            print(directions)
+    found = Query_cache.cached(query_cache, 'recipes', 'select_recipe_chicken_parmesan',
+                               find_chicken_parmesan_directions)
+    for directions in found:
+        Measurement.log(directions)
+    return found
+
+
+def find_recipes_by_title(title, path='$'):
+    if title_index_mode == 'search':
+        response = redis_client.execute_command('FT.SEARCH', title_search_index,
+                                                f'@title:{{{escape_tag_value(title)}}}',
+                                                'RETURN', '1', path, 'LIMIT', '0', '10000')
+        # Ответ: количество, затем пары (ключ, [поле, значение])
+        return [(key, json.loads(fields[1])) for key, fields in zip(response[1::2], response[2::2])]
+    keys = redis_client.smembers(title_index_key(title))
+    return fetch_recipes(list(keys), path) if keys else []
+
+
+@measure_execution_time
+def select_recipe_chicken_parmesan_indexed():
+    for _, directions in find_recipes_by_title('Baked Chicken Parmesan', '$.directions'):
+        Measurement.log(directions)
 
 
 def perform_select_table_operations_chicken(iterations: int) -> list[float]:
     execution_times = []
-    for _ in range(iterations):
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        snapshot = begin_server_stats()
         _, exec_time = select_recipe_chicken_parmesan()
-        execution_times.append(exec_time)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+            end_server_stats('select_redis', snapshot)
+
+    Measurement.store_results(results_redis["select_redis"], execution_times, sample_name="select_redis")
+    results_redis["select_redis"].update(server_stats_summary('select_redis', execution_times))
+
+    return execution_times
+
 
-    mean_insert_time = round(statistics.mean(execution_times), 5)
-    variance_insert_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
+def perform_select_table_operations_chicken_indexed(iterations: int) -> list[float]:
+    execution_times = []
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        _, exec_time = select_recipe_chicken_parmesan_indexed()
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
 
-    results_redis["select_redis"]["iterations"] = iterations
-    results_redis["select_redis"]["mean_time"] = mean_insert_time
-    results_redis["select_redis"]["variance_time"] = variance_insert_time
-    results_redis["select_redis"]["total_execution_time"] = total_execution_time
+    results_redis["select_redis_title_index"] = {"mode": title_index_mode}
+    Measurement.store_results(results_redis["select_redis_title_index"], execution_times,
+                              sample_name="select_redis_title_index")
 
     return execution_times
 
 
+def trigram_candidates(substring):
+    # Ключи, в названиях которых есть все триграммы подстроки; None - индекс не поможет
+    # (выключен или подстрока короче трех символов)
+    trigrams = title_trigrams(substring)
+    if not trigram_index_enabled or not trigrams:
+        return None
+    return redis_client.sinter(*(trigram_index_key(trigram) for trigram in trigrams))
+
+
+def scan_titles_containing(substring):
+    # У подстроки длиннее трех символов все ее триграммы могут встретиться в названии в разных местах,
+    # не образуя саму подстроку, поэтому кандидаты из индекса проверяются по названию
+    substring = substring.lower()
+    candidates = trigram_candidates(substring)
+    if candidates is None:
+        titles = scan_recipes('$.title')
+    else:
+        titles = chain.from_iterable(fetch_recipes(keys, '$.title')
+                                     for keys in iter_batches(candidates, scan_chunk_size))
+    return ((key, title) for key, title in titles if substring in title.lower())
+
+
+@measure_execution_time
+def select_recipes_title_contains(substring='pie'):
+    found = list(scan_titles_containing(substring))
+    Measurement.log(f"Found {len(found)} recipes with '{substring}' in title")
+    return found
+
+
 @measure_execution_time
 def delete_record_with_pie():
-    keys = redis_client.keys('recipe:*')
-    for key in keys:
-        recipe_data = redis_client.execute_command('JSON.GET', key)
-        if 'pie' in recipe_data.get('title').lower():
-            redis_client.delete(key)
-            print(f"Deleted {key}")
+    pie_keys = (key for key, _ in scan_titles_containing('pie'))
+    for keys in iter_batches(pie_keys, scan_chunk_size):
+        delete_recipe_batch(keys)
+        for key in keys:
+            Measurement.log(f"Deleted {key}")
+    Query_cache.invalidate(query_cache, 'recipes')
+
+
+def run_server_side_scan(script, pattern='recipe:*', chunk_size=scan_chunk_size):
+    # Вызываем скрипт через EVALSHA для каждого шага курсора, пока SCAN не вернет 0.
+    # Возвращает затронутые ключи (со старыми значениями, если на клиенте ведутся индексы)
+    with_values = indexes_enabled()
+    cursor = 0
+    while True:
+        cursor, items = script(args=[cursor, pattern, chunk_size, int(with_values)])
+        if with_values:
+            yield [(key, json.loads(value)[0]) for key, value in zip(items[0::2], items[1::2])]
+        else:
+            yield [(key, None) for key in items]
+        if int(cursor) == 0:
+            break
+
+
+@measure_execution_time
+def delete_record_with_pie_server_side():
+    for removed in run_server_side_scan(delete_pie_script):
+        if removed and indexes_enabled():
+            pipe = redis_client.pipeline(transaction=False)
+            update_recipe_indexes(pipe, removed=removed)
+            pipe.execute()
+        for key, _ in removed:
+            Measurement.log(f"Deleted {key}")
+    Query_cache.invalidate(query_cache, 'recipes')
 
 
 def perform_delete_table_operations_pie(iterations: int) -> list[float]:
     execution_times = []
-    for _ in range(iterations):
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        snapshot = begin_server_stats()
         _, exec_time = delete_record_with_pie()
-        execution_times.append(exec_time)
-        insert_data_to_redis(data)
-
-    mean_insert_time = round(statistics.mean(execution_times), 5)
-    variance_insert_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+            end_server_stats('delete_redis', snapshot)
+        restore_redis_data()
 
-    results_redis["delete_redis"]["iterations"] = iterations
-    results_redis["delete_redis"]["mean_time"] = mean_insert_time
-    results_redis["delete_redis"]["variance_time"] = variance_insert_time
-    results_redis["delete_redis"]["total_execution_time"] = total_execution_time
+    Measurement.store_results(results_redis["delete_redis"], execution_times, sample_name="delete_redis")
+    results_redis["delete_redis"].update(server_stats_summary('delete_redis', execution_times))
 
     return execution_times
 
 
 @measure_execution_time
 def update_ingredients_water_to_test():
-    keys = redis_client.keys('recipe:*')
-    for key in keys:
-        recipe_data = redis_client.execute_command('JSON.GET', key)
-        if recipe_data:
-            ner_list = recipe_data.get('NER', [])
-            if 'water' in ner_list:
-                updated_ner = [ner.replace('water', 'TEST') for ner in ner_list]
-                redis_client.execute_command('JSON.SET', key, '.', json.dumps(updated_ner))
-                print(f'Updated {key}')
+    water_recipes = ((key, ner_list) for key, ner_list in scan_recipes('$.NER') if 'water' in ner_list)
+    for batch in iter_batches(water_recipes, scan_chunk_size):
+        update_ner_batch(batch, 'water', 'TEST')
+        for key, _ in batch:
+            Measurement.log(f'Updated {key}')
+    Query_cache.invalidate(query_cache, 'recipes')
+
+
+@measure_execution_time
+def update_ingredients_water_to_test_server_side():
+    for updated in run_server_side_scan(update_water_script):
+        if updated and indexes_enabled():
+            pipe = redis_client.pipeline(transaction=False)
+            update_recipe_indexes(pipe,
+                                  added=[(key, {'NER': [ner.replace('water', 'TEST') for ner in ner_list]})
+                                         for key, ner_list in updated],
+                                  removed=[(key, {'NER': ner_list}) for key, ner_list in updated])
+            pipe.execute()
+        for key, _ in updated:
+            Measurement.log(f'Updated {key}')
+    Query_cache.invalidate(query_cache, 'recipes')
 
 
 def perform_update_table_operations(iterations: int) -> list[float]:
     execution_times = []
-    for _ in range(iterations):
+    for iteration in range(Measurement.warmup_iterations + iterations):
+        snapshot = begin_server_stats()
         _, exec_time = update_ingredients_water_to_test()
-        execution_times.append(exec_time)
-        insert_data_to_redis(data)
+        if iteration >= Measurement.warmup_iterations:
+            execution_times.append(exec_time)
+            end_server_stats('update_redis', snapshot)
+        restore_redis_data()
+
+    Measurement.store_results(results_redis["update_redis"], execution_times, sample_name="update_redis")
+    results_redis["update_redis"].update(server_stats_summary('update_redis', execution_times))
+
+    return execution_times
+
+
+def perform_server_side_operations(iterations: int) -> dict:
+    # Сравниваем клиентские и серверные (Lua) версии удаления и обновления
+    execution_times = {"delete_redis": [], "update_redis": []}
+    for _ in range(iterations):
+        _, exec_time = delete_record_with_pie_server_side()
+        execution_times["delete_redis"].append(exec_time)
+        restore_redis_data()
+        _, exec_time = update_ingredients_water_to_test_server_side()
+        execution_times["update_redis"].append(exec_time)
+        restore_redis_data()
+
+    for operation, times in execution_times.items():
+        section = Measurement.store_results({}, times, sample_name=f"{operation}_server_side")
+        section["client_side_mean_time"] = results_redis[operation]["mean_time"]
+        section["speedup"] = round(results_redis[operation]["mean_time"] / section["mean_time"], 2)
+        results_redis[f"{operation}_server_side"] = section
+
+    return execution_times
+
+
+def perform_ner_index_operations(iterations: int, source) -> dict:
+    # Сравниваем операции записи без индекса и с индексом, а также выборку топ-50 сканированием и по индексу
+    # Кэш выборок выключается, иначе базовое сканирование отдает кэшированный результат и select_speedup занижен
+    global ner_index_enabled
+    previous_state, previous_cache = ner_index_enabled, query_cache
+    use_query_cache(None)
+    execution_times = {}
+    try:
+        for indexed in (False, True):
+            ner_index_enabled = indexed
+            suffix = '_indexed' if indexed else ''
+            for operation in ('insert', 'delete', 'update'):
+                execution_times[operation + suffix] = []
+            for _ in range(iterations):
+                clear_redis_data()
+                _, exec_time, _ = insert_from_source(insert_data_to_redis_batched, source)
+                execution_times['insert' + suffix].append(exec_time)
+                _, exec_time = delete_record_with_pie()
+                execution_times['delete' + suffix].append(exec_time)
+                restore_redis_data()
+                _, exec_time = update_ingredients_water_to_test()
+                execution_times['update' + suffix].append(exec_time)
+                restore_redis_data()
+
+        execution_times['select'] = [select_most_common_ner()[1] for _ in range(iterations)]
+        execution_times['select_indexed'] = [select_most_common_ner_indexed()[1] for _ in range(iterations)]
+    finally:
+        use_query_cache(previous_cache)
 
-    mean_insert_time = round(statistics.mean(execution_times), 5)
-    variance_insert_time = round(statistics.variance(execution_times), 5)
-    total_execution_time = round(sum(execution_times), 5)
+    ner_index_enabled = previous_state
+    if not ner_index_enabled:
+        redis_client.delete(ner_index_key)
 
-    results_redis["update_redis"]["iterations"] = iterations
-    results_redis["update_redis"]["mean_time"] = mean_insert_time
-    results_redis["update_redis"]["variance_time"] = variance_insert_time
-    results_redis["update_redis"]["total_execution_time"] = total_execution_time
+    section = {"iterations": iterations}
+    for name, times in execution_times.items():
+        summary = Measurement.summarize(times)
+        section[f"mean_time_{name}"] = summary["mean_time"]
+        section[f"p99_time_{name}"] = summary["p99"]
+    for operation in ('insert', 'delete', 'update'):
+        section[f"overhead_{operation}"] = round(
+            section[f"mean_time_{operation}_indexed"] - section[f"mean_time_{operation}"], 5)
+    section["select_speedup"] = round(section["mean_time_select"] / section["mean_time_select_indexed"], 2)
+    results_redis["ner_index_redis"] = section
 
     return execution_times
 
 
-data = load_data_from_csv('dataset/full_dataset.csv', limit=10000)
-perform_insert_table_operations(5, data)
-perform_select_table_operations_most_common(100)
-perform_select_table_operations_chicken(100)
-perform_delete_table_operations_pie(100)
-perform_update_table_operations(100)
-write_results_to_excel(results_redis)
-with open('redis_dict.json', 'w') as file:
-    json.dump(results_redis, file, indent=4)
+def perform_trigram_index_operations(iterations: int, source, substring='pie') -> dict:
+    # Сравниваем вставку (стоимость ведения индекса), поиск подстроки в названии и удаление
+    # полным сканированием и через триграммный индекс
+    global trigram_index_enabled
+    previous_state = trigram_index_enabled
+    execution_times = {}
+    for indexed in (False, True):
+        trigram_index_enabled = indexed
+        suffix = '_indexed' if indexed else ''
+        for operation in ('insert', 'select', 'delete'):
+            execution_times[operation + suffix] = []
+        for _ in range(iterations):
+            clear_redis_data()
+            _, exec_time, _ = insert_from_source(insert_data_to_redis_batched, source)
+            execution_times['insert' + suffix].append(exec_time)
+            _, exec_time = select_recipes_title_contains(substring)
+            execution_times['select' + suffix].append(exec_time)
+            _, exec_time = delete_record_with_pie()
+            execution_times['delete' + suffix].append(exec_time)
+        restore_redis_data()
+
+    # Избирательность индекса: сколько кандидатов дает SINTER и сколько из них подтверждает проверка
+    candidates = trigram_candidates(substring)
+    matches = select_recipes_title_contains(substring)[0]
+
+    trigram_index_enabled = previous_state
+    if not trigram_index_enabled:
+        for keys in iter_batches(redis_client.scan_iter(match=trigram_index_key('*'), count=scan_chunk_size),
+                                 scan_chunk_size):
+            redis_client.delete(*keys)
+
+    section = {"iterations": iterations, "substring": substring,
+               "candidates": len(candidates or ()), "matches": len(matches)}
+    for name, times in execution_times.items():
+        summary = Measurement.summarize(times)
+        section[f"mean_time_{name}"] = summary["mean_time"]
+        section[f"p99_time_{name}"] = summary["p99"]
+    section["overhead_insert"] = round(section["mean_time_insert_indexed"] - section["mean_time_insert"], 5)
+    for operation in ('select', 'delete'):
+        section[f"{operation}_speedup"] = round(
+            section[f"mean_time_{operation}"] / section[f"mean_time_{operation}_indexed"], 2)
+    results_redis["trigram_index_redis"] = section
+
+    return execution_times
+
+
+@measure_execution_time
+def scan_all_recipes():
+    return sum(1 for _ in scan_recipes())
+
+
+def perform_codec_operations(iterations: int, source, names: list[str]) -> dict:
+    # Для каждого формата: объем на рецепт, процессорное время кодирования и декодирования на рецепт
+    # и полное время основных операций. Кэш выборок на время сравнения выключается
+    global codec
+    previous_codec, previous_cache = codec, query_cache
+    use_query_cache(None)
+    codec_execution_times = {}
+    try:
+        for name in names:
+            if name not in Redis_codec.codecs:
+                print(f"Unknown Redis codec '{name}', skipping")
+                continue
+            codec = Redis_codec.codecs[name]
+            execution_times = {"insert": [], "select_most_common_ner": [], "select_chicken_parmesan": [],
+                               "scan_all": [], "update": []}
+            Redis_codec.reset_stats()
+            for _ in range(iterations):
+                clear_redis_data()
+                inserted, exec_time, _ = insert_from_source(insert_data_to_redis_batched, source)
+                execution_times["insert"].append(exec_time)
+            encode_time = Redis_codec.stats["encode_time"] / (inserted * iterations) if inserted else 0
+            footprint = collect_storage_footprint()
+
+            Redis_codec.reset_stats()
+            for _ in range(iterations):
+                _, exec_time = scan_all_recipes()
+                execution_times["scan_all"].append(exec_time)
+            decode_time = Redis_codec.stats["decode_time"] / (inserted * iterations) if inserted else 0
+
+            for _ in range(iterations):
+                execution_times["select_most_common_ner"].append(select_most_common_ner()[1])
+                execution_times["select_chicken_parmesan"].append(select_recipe_chicken_parmesan()[1])
+                _, exec_time = update_ingredients_water_to_test()
+                execution_times["update"].append(exec_time)
+                restore_redis_data()
+
+            section = {"codec": name, "recipes": inserted,
+                       "bytes_per_recipe": footprint.get("sampled_bytes_per_recipe", 0),
+                       "dataset_bytes_per_recipe": footprint.get("dataset_bytes_per_recipe", 0),
+                       "encode_time_per_recipe": round(encode_time, 9),
+                       "decode_time_per_recipe": round(decode_time, 9)}
+            for operation, times in execution_times.items():
+                summary = Measurement.summarize(times)
+                section[f"mean_time_{operation}"] = summary["mean_time"]
+                section[f"p99_time_{operation}"] = summary["p99"]
+            results_redis[f"codec_redis_{name}"] = section
+            codec_execution_times[name] = execution_times
+    finally:
+        codec = previous_codec
+        use_query_cache(previous_cache)
+        restore_redis_data()
+
+    return codec_execution_times
+
+
+class HashRing:
+    # Консистентное хэширование: у каждого узла shard_virtual_nodes точек на кольце,
+    # ключ попадает на первую точку по часовой стрелке от своего хэша
+    def __init__(self, shard_count, virtual_nodes=shard_virtual_nodes):
+        points = sorted((self.hash(f"shard-{shard}-{node}"), shard)
+                        for shard in range(shard_count) for node in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    def shard_for(self, key):
+        position = bisect.bisect(self.hashes, self.hash(key)) % len(self.hashes)
+        return self.shards[position]
+
+
+def create_shard_clients(endpoints):
+    clients = []
+    for endpoint in endpoints:
+        shard_host, shard_port = endpoint.rsplit(':', 1)
+        clients.append(Client(host=shard_host, port=int(shard_port), decode_responses=True))
+    return clients
+
+
+def write_shard_batch(client, batch):
+    pipe = client.pipeline(transaction=False)
+    codec.write_many(pipe, batch)
+    pipe.execute()
+
+
+@measure_execution_time
+def insert_data_to_redis_sharded(data, clients, ring, executor, batch_size=1000):
+    # Пачка делится по узлам, и части пишутся на узлы параллельно; индексы в шардированном режиме не ведутся
+    inserted = 0
+    for batch in iter_batches(((f"recipe:{idx}", recipe) for idx, recipe in enumerate(data)),
+                              batch_size * len(clients)):
+        shard_batches = [[] for _ in clients]
+        for key, recipe in batch:
+            shard_batches[ring.shard_for(key)].append((key, recipe))
+        futures = [executor.submit(write_shard_batch, client, shard_batch)
+                   for client, shard_batch in zip(clients, shard_batches) if shard_batch]
+        for future in futures:
+            future.result()
+        inserted += len(batch)
+    return inserted
+
+
+def count_ner_on_shard(client):
+    return Counter(chain.from_iterable(ner_list for _, ner_list in scan_recipes('$.NER', client=client)))
+
+
+@measure_execution_time
+def select_most_common_ner_sharded(clients, executor):
+    # Частичные частоты NER считаются на всех узлах параллельно и складываются на клиенте
+    ner_counts = sum(executor.map(count_ner_on_shard, clients), Counter())
+    top_ner = ner_counts.most_common(50)
+    for position, (ner_entity, count) in enumerate(top_ner, start=1):
+        Measurement.log(f"{position}: {ner_entity} {count}")
+    return top_ner
+
+
+def find_chicken_parmesan_on_shard(client):
+    keys = [key for key, title in scan_recipes('$.title', client=client) if title == 'Baked Chicken Parmesan']
+    return [directions for _, directions in fetch_recipes(keys, '$.directions', client)] if keys else []
+
+
+@measure_execution_time
+def select_recipe_chicken_parmesan_sharded(clients, executor):
+    found = list(chain.from_iterable(executor.map(find_chicken_parmesan_on_shard, clients)))
+    for directions in found:
+        Measurement.log(directions)
+    return found
+
+
+def perform_sharded_operations(iterations: int, source, endpoints: list[str]) -> dict:
+    # Масштабирование по числу узлов: вставка и обе выборки на 1, 2, ... N первых узлах.
+    # Потоки отдают GIL на время сетевого ввода-вывода, разбор JSON на клиенте остается последовательным
+    all_clients = create_shard_clients(endpoints)
+    sharded_execution_times = {}
+    for shard_count in range(1, len(all_clients) + 1):
+        clients = all_clients[:shard_count]
+        ring = HashRing(shard_count)
+        execution_times = {"insert": [], "select_most_common_ner": [], "select_chicken_parmesan": []}
+        with ThreadPoolExecutor(max_workers=shard_count) as executor:
+            for _ in range(iterations):
+                for client in all_clients:
+                    clear_redis_data(client=client)
+                inserted, exec_time, _ = insert_from_source(insert_data_to_redis_sharded, source,
+                                                            clients, ring, executor)
+                execution_times["insert"].append(exec_time)
+            for _ in range(iterations):
+                execution_times["select_most_common_ner"].append(
+                    select_most_common_ner_sharded(clients, executor)[1])
+                execution_times["select_chicken_parmesan"].append(
+                    select_recipe_chicken_parmesan_sharded(clients, executor)[1])
+
+        section = {"shards": shard_count, "recipes": inserted}
+        for operation, times in execution_times.items():
+            summary = Measurement.summarize(times)
+            section[f"mean_time_{operation}"] = summary["mean_time"]
+            section[f"p99_time_{operation}"] = summary["p99"]
+        section["insert_rows_per_second"] = round(inserted / section["mean_time_insert"], 2) \
+            if section["mean_time_insert"] else 0
+        for operation in ("select_most_common_ner", "select_chicken_parmesan"):
+            section[f"{operation}_per_second"] = round(1 / section[f"mean_time_{operation}"], 2) \
+                if section[f"mean_time_{operation}"] else 0
+        section["keys_per_shard"] = ', '.join(str(client.dbsize()) for client in clients)
+        results_redis[f"sharded_redis_{shard_count}"] = section
+        sharded_execution_times[shard_count] = execution_times
+
+    for client in all_clients:
+        clear_redis_data(client=client)
+    return sharded_execution_times
+
+
+def use_query_cache(cache):
+    global query_cache
+    query_cache = cache
+
+
+def perform_query_cache_operations(iterations: int) -> dict:
+    previous_cache = query_cache
+    try:
+        report = Query_cache.perform_cache_operations(
+            'redis',
+            {"select_most_common_ner": select_most_common_ner, "select_chicken_parmesan": select_recipe_chicken_parmesan},
+            use_query_cache, lambda: Query_cache.invalidate(query_cache, 'recipes'), iterations)
+    finally:
+        use_query_cache(previous_cache)
+    for name, section in report.items():
+        results_redis[f"query_cache_redis_{name}"] = section
+    return report
+
+
+def perform_sweep_operations(sizes: list[int], iterations: int) -> dict:
+    # Полный набор CRUD на каждом размере набора данных (0 - весь файл) для построения кривых масштабирования.
+    # recipe_source и restore_redis_data читают dataset_limit, поэтому размер меняется через него
+    # Кэш выборок на время прогона выключается, чтобы кривые отражали стоимость самих запросов
+    global dataset_limit
+    previous_limit, previous_cache = dataset_limit, query_cache
+    use_query_cache(None)
+    sweep = {}
+    try:
+        for size in sizes:
+            dataset_limit = size or None
+            print(f"Running CRUD suite on {Measurement.sweep_label(size)} rows")
+            execution_times = {
+                "insert": perform_insert_table_operations(iterations, recipe_source),
+                "select_most_common_ner": perform_select_table_operations_most_common(iterations),
+                "select_chicken_parmesan": perform_select_table_operations_chicken(iterations),
+                "delete": perform_delete_table_operations_pie(iterations),
+                "update": perform_update_table_operations(iterations),
+            }
+            footprint = collect_storage_footprint()
+            sweep[Measurement.sweep_label(size)] = Measurement.summarize_sweep_point(footprint.get("recipes", 0),
+                                                                                    execution_times)
+            sweep[Measurement.sweep_label(size)]["bytes_per_recipe"] = footprint.get("bytes_per_recipe", 0)
+    finally:
+        dataset_limit = previous_limit
+        use_query_cache(previous_cache)
+    results_redis["sweep_redis"] = sweep
+    return sweep
+
+
+if __name__ == '__main__':
+    create_title_index()
+    if Measurement.sweep_sizes:
+        perform_sweep_operations(Measurement.sweep_sizes, Measurement.sweep_iterations)
+    else:
+        perform_insert_table_operations(5, recipe_source)
+        results_redis["storage_redis"] = collect_storage_footprint()
+        perform_insert_batched_operations(5, recipe_source, insert_batch_sizes)
+        perform_insert_parallel_ingest_operations(5, dataset_path, dataset_limit)
+        perform_select_table_operations_most_common(100)
+        perform_select_table_operations_chicken(100)
+        perform_query_cache_operations(100)
+        if title_index_mode:
+            perform_select_table_operations_chicken_indexed(100)
+        perform_delete_table_operations_pie(100)
+        perform_update_table_operations(100)
+        # Lua-скрипты разбирают документы RedisJSON, для других форматов серверных версий нет
+        if codec.server_side:
+            perform_server_side_operations(100)
+        perform_ner_index_operations(10, recipe_source)
+        perform_trigram_index_operations(10, recipe_source)
+        perform_codec_operations(5, recipe_source, compared_codecs)
+        if shard_endpoints:
+            perform_sharded_operations(5, recipe_source, shard_endpoints)
+    Measurement.save_profiles('redis')
+    results_redis["memory_redis"] = {"peak_rss_mb": peak_rss_megabytes()}
+    # Вложенные результаты прогона по размерам в таблицу Excel не помещаются, они есть в redis_dict.json
+    write_results_to_excel({name: section for name, section in results_redis.items() if name != 'sweep_redis'})
+    with open('redis_dict.json', 'w') as file:
+        json.dump(results_redis, file, indent=4)
@@ -1,8 +1,11 @@
 import json
+import os
 
 import matplotlib.pyplot as plt
 import numpy as np
 
+from Measurement import load_samples, samples_directory
+
 # Загрузка данных из JSON-файлов
 with open('clickhouse_dict.json', 'r') as file, open('redis_dict.json', 'r') as file1:
     loaded_dict_clickhouse = json.load(file)
@@ -10,22 +13,31 @@ with open('clickhouse_dict.json', 'r') as file, open('redis_dict.json', 'r') as
 
 merged_dict = loaded_dict_clickhouse | loaded_dict_redis
 
+# Встроенное хранилище (Embedded_script.py) - необязательная третья база
+if os.path.exists('embedded_dict.json'):
+    with open('embedded_dict.json', 'r') as file:
+        merged_dict |= json.load(file)
+
+# Базы на диаграммах и суффиксы их секций в словаре результатов
+backends = [(label, suffix) for label, suffix in (('ClickHouse', ''), ('Redis', '_redis'), ('Embedded', '_embedded'))
+            if 'insert' + suffix in merged_dict]
+backends_title = ' vs '.join(label for label, _ in backends)
+
 
 # Функция для построения столбчатых диаграмм
 def plot_comparison_bar_charts(data, metric, title):
     operations = ['insert', 'select', 'update', 'delete']
-    redis_operations = [op + '_redis' for op in operations]
 
     x = np.arange(len(operations))  # Положение столбцов
-    width = 0.35  # Ширина столбца
+    width = 0.8 / len(backends)  # Ширина столбца
 
     fig, ax = plt.subplots(figsize=(10, 6))
 
-    values1 = [data[op].get(metric, 0) for op in operations]
-    values2 = [data[op].get(metric, 0) for op in redis_operations]
-
-    bars1 = ax.bar(x - width/2, values1, width, label='ClickHouse')
-    bars2 = ax.bar(x + width/2, values2, width, label='Redis')
+    bar_groups = []
+    for position, (label, suffix) in enumerate(backends):
+        values = [data[op + suffix].get(metric, 0) for op in operations]
+        offset = (position - (len(backends) - 1) / 2) * width
+        bar_groups.append(ax.bar(x + offset, values, width, label=label))
 
     ax.set_xlabel('CRUD Operations')
     ax.set_ylabel(metric.capitalize().replace('_', ' '))
@@ -35,7 +47,7 @@ def plot_comparison_bar_charts(data, metric, title):
     ax.legend()
 
     # Добавление подписей значений на столбцы
-    for bars in [bars1, bars2]:
+    for bars in bar_groups:
         for bar in bars:
             yval = bar.get_height()
             ax.text(bar.get_x() + bar.get_width()/2, yval, round(yval, 2), va='bottom')
@@ -43,10 +55,221 @@ def plot_comparison_bar_charts(data, metric, title):
     fig.tight_layout()
 
 
+# Файлы с сырыми замерами по базам: в словарях результатов select и select_2 у ClickHouse и Redis перепутаны местами,
+# встроенное хранилище следует порядку ClickHouse
+distribution_pairs = [
+    ('insert', 'insert', 'insert_redis', 'insert_embedded'),
+    ('select most common NER', 'select', 'select_redis_2', 'select_embedded'),
+    ('select chicken parmesan', 'select_2', 'select_redis', 'select_embedded_2'),
+    ('delete', 'delete', 'delete_redis', 'delete_embedded'),
+    ('update', 'update', 'update_redis', 'update_embedded'),
+]
+
+
+def find_samples(directory, name):
+    for extension in ('.bin', '.parquet'):
+        path = os.path.join(directory, name + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# Функция для построения распределений задержек (ECDF) с отметками перцентилей
+def plot_latency_distributions(directory):
+    plotted = False
+    for operation, *names in distribution_pairs:
+        samples = {
+            label: load_samples(path)
+            for label, path in ((label, find_samples(directory, name))
+                                for label, name in zip(('ClickHouse', 'Redis', 'Embedded'), names))
+            if path
+        }
+        if not samples:
+            continue
+
+        fig, ax = plt.subplots(figsize=(10, 6))
+        for label, values in samples.items():
+            values = np.sort(values)
+            ecdf = np.arange(1, len(values) + 1) / len(values)
+            line, = ax.step(values, ecdf, where='post', label=label)
+            for percentile in (50, 99):
+                ax.axvline(np.percentile(values, percentile), color=line.get_color(), linestyle='--', alpha=0.5)
+
+        ax.set_xscale('log')
+        ax.set_xlabel('Latency, s (dashed lines: p50, p99)')
+        ax.set_ylabel('Fraction of iterations')
+        ax.set_title(f'Latency distribution of {operation} ({" vs ".join(samples)})')
+        ax.legend()
+        fig.tight_layout()
+        plotted = True
+    return plotted
+
+
+# Функция для построения кривых масштабирования: время операции от числа строк в логарифмическом масштабе.
+# Наклон прямой в log-log координатах - показатель степени k в t ~ n^k, k заметно больше 1 - сверхлинейный рост
+def plot_scaling_curves(data):
+    sweeps = {label: data[key] for label, key in (('ClickHouse', 'sweep'), ('Redis', 'sweep_redis')) if data.get(key)}
+    if not sweeps:
+        return False
+
+    operations = sorted({operation for sweep in sweeps.values()
+                         for point in sweep.values() for operation in point["operations"]})
+    fig, axes = plt.subplots(1, len(operations), figsize=(5 * len(operations), 5), squeeze=False)
+    for ax, operation in zip(axes[0], operations):
+        for label, sweep in sweeps.items():
+            points = sorted((point["rows"], point["operations"][operation]["mean_time"])
+                            for point in sweep.values()
+                            if operation in point["operations"] and point["rows"] and point["operations"][operation]["mean_time"])
+            if not points:
+                continue
+            rows, times = map(np.array, zip(*points))
+            line, = ax.plot(rows, times, marker='o', label=label)
+            if len(points) > 1:
+                exponent, intercept = np.polyfit(np.log(rows), np.log(times), 1)
+                ax.plot(rows, np.exp(intercept) * rows ** exponent, color=line.get_color(), linestyle='--',
+                        label=f'{label} fit: k={exponent:.2f}')
+                if exponent > 1.2:
+                    print(f"Warning: {label} {operation} scales superlinearly (k={exponent:.2f})")
+
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('Rows')
+        ax.set_ylabel('Mean time, s')
+        ax.set_title(operation)
+        ax.legend()
+    fig.suptitle('Scaling curves (ClickHouse vs Redis)')
+    fig.tight_layout()
+    return True
+
+
+plot_scaling_curves(merged_dict)
+
+
+# Функция для построения диаграмм объема: байт на рецепт у каждой схемы ClickHouse (на диске) и у Redis (в памяти),
+# а также сжатый и несжатый размер столбцов ClickHouse
+def plot_storage_footprint(data):
+    footprints = {
+        ('Redis' if name == 'storage_redis' else f"ClickHouse {section.get('schema', 'base')}"): section
+        for name, section in data.items()
+        if name.startswith('storage') and section.get('bytes_per_recipe')
+    }
+    if not footprints:
+        return False
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    labels = list(footprints)
+    bars = ax.bar(labels, [footprints[label]['bytes_per_recipe'] for label in labels])
+    for bar in bars:
+        ax.text(bar.get_x() + bar.get_width()/2, bar.get_height(), round(bar.get_height(), 1), va='bottom')
+    ax.set_ylabel('Bytes per recipe')
+    ax.set_title('Storage footprint per recipe (ClickHouse on disk vs Redis in memory)')
+    fig.tight_layout()
+
+    columns = data.get('storage', {}).get('columns')
+    if columns:
+        names = list(columns)
+        x = np.arange(len(names))
+        width = 0.35
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.bar(x - width/2, [columns[name]['compressed_bytes'] for name in names], width, label='Compressed')
+        ax.bar(x + width/2, [columns[name]['uncompressed_bytes'] for name in names], width, label='Uncompressed')
+        ax.set_xticks(x)
+        ax.set_xticklabels(names)
+        ax.set_ylabel('Bytes')
+        ax.set_title('ClickHouse column sizes')
+        ax.legend()
+        fig.tight_layout()
+    return True
+
+
+plot_storage_footprint(merged_dict)
+
+
+# Функция для построения масштабирования по числу узлов: пропускная способность вставки и выборок
+def plot_shard_scaling(data):
+    backends = {}
+    for name, section in data.items():
+        if name.startswith('sharded_redis_'):
+            backends.setdefault('Redis', []).append(section)
+        elif name.startswith('sharded_'):
+            backends.setdefault('ClickHouse', []).append(section)
+    if not backends:
+        return False
+
+    fig, (insert_ax, select_ax) = plt.subplots(1, 2, figsize=(12, 5))
+    for label, sections in backends.items():
+        sections.sort(key=lambda section: section['shards'])
+        shards = [section['shards'] for section in sections]
+        insert_ax.plot(shards, [section['insert_rows_per_second'] for section in sections], marker='o', label=label)
+        for operation in ('select_most_common_ner', 'select_chicken_parmesan'):
+            select_ax.plot(shards, [section[f'{operation}_per_second'] for section in sections], marker='o',
+                           label=f'{label} {operation}')
+    insert_ax.set_title('Insert throughput')
+    insert_ax.set_ylabel('Rows per second')
+    select_ax.set_title('Scatter-gather query throughput')
+    select_ax.set_ylabel('Queries per second')
+    for ax in (insert_ax, select_ax):
+        ax.set_xlabel('Shards')
+        ax.set_yscale('log')
+        ax.legend()
+    fig.suptitle('Scaling with shard count (ClickHouse vs Redis)')
+    fig.tight_layout()
+    return True
+
+
+plot_shard_scaling(merged_dict)
+
+
+# Функция для сравнения форматов хранения Redis: байт на рецепт, время кодирования и декодирования на рецепт
+# и среднее время операций
+def plot_codec_comparison(data):
+    codecs = {section['codec']: section for name, section in data.items() if name.startswith('codec_redis_')}
+    if not codecs:
+        return False
+
+    names = list(codecs)
+    x = np.arange(len(names))
+    fig, (size_ax, cpu_ax, latency_ax) = plt.subplots(1, 3, figsize=(16, 5))
+    size_ax.bar(x, [codecs[name]['bytes_per_recipe'] for name in names])
+    size_ax.set_ylabel('Bytes per recipe')
+    size_ax.set_title('Memory per recipe')
+
+    width = 0.35
+    cpu_ax.bar(x - width/2, [codecs[name]['encode_time_per_recipe'] * 1e6 for name in names], width, label='Encode')
+    cpu_ax.bar(x + width/2, [codecs[name]['decode_time_per_recipe'] * 1e6 for name in names], width, label='Decode')
+    cpu_ax.set_ylabel('CPU time per recipe, us')
+    cpu_ax.set_title('Client encode/decode cost')
+    cpu_ax.legend()
+
+    operations = ['insert', 'select_most_common_ner', 'select_chicken_parmesan', 'scan_all', 'update']
+    width = 0.8 / len(operations)
+    for position, operation in enumerate(operations):
+        offset = (position - (len(operations) - 1) / 2) * width
+        latency_ax.bar(x + offset, [codecs[name][f'mean_time_{operation}'] for name in names], width, label=operation)
+    latency_ax.set_ylabel('Mean time, s')
+    latency_ax.set_yscale('log')
+    latency_ax.set_title('End-to-end latency')
+    latency_ax.legend()
+
+    for ax in (size_ax, cpu_ax, latency_ax):
+        ax.set_xticks(x)
+        ax.set_xticklabels(names)
+    fig.suptitle('Redis storage encodings')
+    fig.tight_layout()
+    return True
+
+
+plot_codec_comparison(merged_dict)
+
+# Если сохранены сырые замеры, средние заменяются распределениями
+if plot_latency_distributions(samples_directory):
+    metrics = ['iterations', 'total_execution_time']
+else:
+    metrics = ['iterations', 'total_execution_time', 'mean_time', 'variance_time']
+
 # Построение диаграммы для каждой метрики
-metrics = ['iterations', 'total_execution_time', 'mean_time', 'variance_time']
 for metric in metrics:
-    plot_comparison_bar_charts(merged_dict, metric, f'Comparison of {metric.capitalize().replace("_", " ")} (ClickHouse vs Redis)')
+    plot_comparison_bar_charts(merged_dict, metric, f'Comparison of {metric.capitalize().replace("_", " ")} ({backends_title})')
 
 plt.show()
 
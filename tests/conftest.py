@@ -0,0 +1,70 @@
+import importlib
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Скрипты лежат в корне репозитория и импортируются как модули верхнего уровня
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+@pytest.fixture(scope='session')
+def redis_server():
+    # Уже запущенный сервер (REDIS_TEST_ENDPOINT=host:port, например fakeredis TcpFakeServer)
+    # или временный локальный redis-stack-server / redis-server на свободном порту.
+    # Нужен модуль RedisJSON: он встроен в Redis 8 и redis-stack-server
+    endpoint = os.getenv("REDIS_TEST_ENDPOINT")
+    if endpoint:
+        host, port = endpoint.rsplit(':', 1)
+        yield host, int(port)
+        return
+    binary = shutil.which('redis-stack-server') or shutil.which('redis-server')
+    if binary is None:
+        pytest.skip("redis-server is not installed and REDIS_TEST_ENDPOINT is not set")
+    host, port = '127.0.0.1', free_port()
+    process = subprocess.Popen([binary, '--port', str(port), '--save', '', '--appendonly', 'no'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_server(host, port):
+            pytest.skip(f"{binary} did not start")
+        yield host, port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.fixture(scope='session')
+def redis_module(redis_server):
+    pytest.importorskip('rejson')
+    host, port = redis_server
+    # Redis_script читает адрес сервера из окружения при импорте
+    os.environ["HOST_REDIS"] = host
+    os.environ["PORT_REDIS"] = str(port)
+    module = importlib.import_module('Redis_script')
+    try:
+        module.redis_client.execute_command('JSON.SET', 'test:probe', '.', '{}')
+        module.redis_client.delete('test:probe')
+    except Exception as e:
+        pytest.skip(f"Redis server without RedisJSON: {e}")
+    return module
@@ -0,0 +1,93 @@
+import pytest
+
+
+def recipe(title, directions):
+    return {'title': title, 'ingredients': ['1 c. water'], 'directions': directions,
+            'link': 'www.example.com', 'source': 'Gathered', 'NER': ['water']}
+
+
+RECIPES = [
+    recipe('Baked Chicken Parmesan', ['Bread the chicken.']),
+    recipe('Apple Pie', ['Bake the pie.']),
+    recipe('Baked Chicken Parmesan', ['Bake the chicken.']),
+    recipe('Tomato Soup', ['Simmer.']),
+]
+
+EXPECTED_TITLE_INDEX = {
+    'Baked Chicken Parmesan': {'recipe:0', 'recipe:2'},
+    'Apple Pie': {'recipe:1'},
+    'Tomato Soup': {'recipe:3'},
+}
+
+
+@pytest.fixture
+def redis_script(redis_module, monkeypatch):
+    monkeypatch.setattr(redis_module, 'title_index_mode', 'set')
+    monkeypatch.setattr(redis_module, 'ner_index_enabled', False)
+    monkeypatch.setattr(redis_module, 'trigram_index_enabled', False)
+    monkeypatch.setattr(redis_module, 'recipe_source', lambda: iter(RECIPES))
+    redis_module.redis_client.flushdb()
+    yield redis_module
+    redis_module.redis_client.flushdb()
+
+
+def title_index(redis_script):
+    prefix = redis_script.title_index_key('')
+    return {key[len(prefix):]: redis_script.redis_client.smembers(key)
+            for key in redis_script.redis_client.scan_iter(match=prefix + '*')}
+
+
+@pytest.mark.parametrize('insert', ['insert_data_to_redis', 'insert_data_to_redis_batched'])
+def test_insert_maintains_title_index(redis_script, insert):
+    getattr(redis_script, insert)(RECIPES)
+
+    assert title_index(redis_script) == EXPECTED_TITLE_INDEX
+
+
+def test_duplicate_titles_return_every_key(redis_script):
+    redis_script.insert_data_to_redis_batched(RECIPES)
+
+    found = redis_script.find_recipes_by_title('Baked Chicken Parmesan', '$.directions')
+
+    assert sorted(found) == [('recipe:0', ['Bread the chicken.']), ('recipe:2', ['Bake the chicken.'])]
+    assert redis_script.find_recipes_by_title('Missing Title') == []
+
+
+@pytest.mark.parametrize('delete', ['delete_record_with_pie', 'delete_record_with_pie_server_side'])
+def test_delete_removes_titles_from_index(redis_script, delete):
+    redis_script.insert_data_to_redis_batched(RECIPES)
+
+    getattr(redis_script, delete)()
+
+    expected = {title: keys for title, keys in EXPECTED_TITLE_INDEX.items() if title != 'Apple Pie'}
+    assert title_index(redis_script) == expected
+    assert redis_script.find_recipes_by_title('Apple Pie') == []
+
+
+def test_restore_rebuilds_title_index(redis_script):
+    redis_script.insert_data_to_redis_batched(RECIPES)
+    redis_script.delete_record_with_pie()
+
+    redis_script.restore_redis_data()
+
+    assert title_index(redis_script) == EXPECTED_TITLE_INDEX
+
+
+def test_search_mode_falls_back_to_sets_without_redisearch(redis_script, monkeypatch):
+    execute_command = redis_script.redis_client.execute_command
+
+    def without_modules(*args, **options):
+        # Сервер без RediSearch: MODULE LIST не возвращает модуль search
+        if args[0] == 'MODULE LIST':
+            return []
+        return execute_command(*args, **options)
+
+    monkeypatch.setattr(redis_script.redis_client, 'execute_command', without_modules)
+    monkeypatch.setattr(redis_script, 'title_index_mode', 'search')
+
+    redis_script.create_title_index()
+    redis_script.insert_data_to_redis_batched(RECIPES)
+
+    assert redis_script.title_index_mode == 'set'
+    assert title_index(redis_script) == EXPECTED_TITLE_INDEX
+    assert {key for key, _ in redis_script.find_recipes_by_title('Baked Chicken Parmesan')} == {'recipe:0', 'recipe:2'}